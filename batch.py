@@ -0,0 +1,175 @@
+'''
+Offline batch execution for evaluation sweeps. Independent requests of a
+sweep phase are written to a JSONL file in the OpenAI batch format, run
+either through the OpenAI Batch API or a local stand-in processor that
+produces output in the same format, and mapped back to their games.
+'''
+import json
+import os
+import time
+
+from llm_utils import *
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+def batch_model(call_site):
+    # The batch API is OpenAI only, so use the first OpenAI model in the route
+    for provider, model in LLM_ROUTES.get(call_site, STRONG_MODELS):
+        if provider == "openai":
+            return model
+    return "gpt-4o"
+
+
+def write_batch_file(path, requests):
+    '''
+    requests is a list of (custom_id, call_site, messages).
+    '''
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, call_site, messages in requests:
+            line = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": batch_model(call_site),
+                    "messages": messages,
+                    "temperature": 1,
+                    "max_tokens": 2000,
+                },
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def read_batch_output(lines):
+    '''
+    Map custom_id to the response content, or to an LLMCallError for
+    requests that failed.
+    '''
+    results = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        body = response.get("body") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            error = item.get("error") or body.get("error")
+            results[item["custom_id"]] = LLMCallError(f"Batch request failed: {error}")
+            continue
+        content = body["choices"][0]["message"]["content"]
+        if not content or not content.strip():
+            results[item["custom_id"]] = LLMCallError("Batch request returned an empty response")
+        else:
+            results[item["custom_id"]] = content
+    return results
+
+
+def submit_openai(path):
+    with open(path, "rb") as f:
+        batch_file = get_oai().files.create(file=f, purpose="batch")
+    batch = get_oai().batches.create(input_file_id=batch_file.id, endpoint=BATCH_ENDPOINT,
+                                     completion_window="24h")
+    print(f"Submitted batch {batch.id} ({path})")
+    return batch.id
+
+
+def poll_openai(batch_id, interval=BATCH_POLL_INTERVAL):
+    while True:
+        batch = get_oai().batches.retrieve(batch_id)
+        counts = batch.request_counts
+        print(f"Batch {batch_id}: {batch.status} ({counts.completed}/{counts.total} done, {counts.failed} failed)")
+        if batch.status in ["completed", "failed", "expired", "cancelled"]:
+            break
+        time.sleep(interval)
+    lines = []
+    # Expired or cancelled batches still return whatever had finished
+    for file_id in [batch.output_file_id, batch.error_file_id]:
+        if file_id:
+            lines.extend(get_oai().files.content(file_id).text.splitlines())
+    return lines
+
+
+def process_local(path, output_path):
+    '''
+    Stand-in for the batch API: runs every request in the batch file through
+    the shared scheduler and writes the output in the batch API's format.
+    '''
+    with open(path, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+
+    def run(item):
+        body = item["body"]
+        try:
+            content = gen_oai(body["messages"], body["model"], temperature=body["temperature"])
+        except LLMCallError as e:
+            return {"custom_id": item["custom_id"], "response": None, "error": {"message": str(e)}}
+        return {"custom_id": item["custom_id"], "error": None,
+                "response": {"status_code": 200,
+                             "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}}}
+
+    lines = [json.dumps(result, ensure_ascii=False) for result in map_concurrent(run, items)]
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return lines
+
+
+def run_batch(requests, name, mode=BATCH_MODE, batch_dir=BATCH_DIR):
+    '''
+    Run one phase of independent requests as a batch and return a dict of
+    custom_id -> content (or LLMCallError). mode is "openai" or "local".
+    '''
+    if not requests:
+        return {}
+    assert mode in ["openai", "local"]
+    path = os.path.join(batch_dir, f"{name}.jsonl")
+    write_batch_file(path, requests)
+    if mode == "openai":
+        lines = poll_openai(submit_openai(path))
+    else:
+        lines = process_local(path, os.path.join(batch_dir, f"{name}_output.jsonl"))
+    results = read_batch_output(lines)
+    for custom_id, _, _ in requests:
+        results.setdefault(custom_id, LLMCallError("Batch returned no result"))
+    return results
+
+
+def run_vote_only_games(games, mode=BATCH_MODE, batch_dir=BATCH_DIR):
+    '''
+    Play single-round (no discussion) games in two batch phases: the
+    chairperson's opening statements, then every agent's vote. games maps a
+    key such as (policy, baseline, run) to a Game; returns key ->
+    (round_data, outcome, vote_list).
+    '''
+    keys = list(games)
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+
+    openings = run_batch(
+        [(f"open-{i}", "chair_announcement", games[key].chairperson.opening_messages())
+         for i, key in enumerate(keys)],
+        f"openings_{stamp}", mode=mode, batch_dir=batch_dir)
+    opening_data = {}
+    for i, key in enumerate(keys):
+        statement = openings[f"open-{i}"]
+        if isinstance(statement, LLMCallError):
+            print(f"Opening statement failed for {key}: {statement}")
+            statement = games[key].chairperson.default_opening
+        opening_data[key] = games[key].record_opening(statement)
+
+    vote_requests = []
+    request_owner = {}
+    for i, key in enumerate(keys):
+        for j, (agent, messages) in enumerate(games[key].vote_requests(1, 1)):
+            custom_id = f"vote-{i}-{j}"
+            vote_requests.append((custom_id, "vote", messages))
+            request_owner[custom_id] = (key, agent.name)
+    votes = run_batch(vote_requests, f"votes_{stamp}", mode=mode, batch_dir=batch_dir)
+
+    responses = {key: {} for key in keys}
+    for custom_id, (key, agent_name) in request_owner.items():
+        responses[key][agent_name] = votes[custom_id]
+    return {key: games[key].record_votes(responses[key], 1, 1, round_data = [opening_data[key]])
+            for key in keys}
@@ -0,0 +1,229 @@
+'''
+End-to-end benchmark of the simulation loop against a simulated-latency LLM
+backend. Drives init_game -> Game.run_round -> _process_voting_results for a
+sweep of council sizes and round counts, and reports per round the wall-clock
+time, number of LLM calls, sequential call depth and input/output tokens.
+
+Usage:
+    python benchmarks/bench_simulation.py --sizes 5 15 50 193 --rounds 1 4 --latency 0.05
+'''
+import argparse
+import ast
+import bisect
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import main as sim
+from llm_utils import set_llm_backend
+from scheduler import configure_scheduler
+
+
+class SimulatedBackend:
+    '''
+    Stand-in for the provider APIs. Sleeps for a fixed latency (plus optional
+    jitter), answers each prompt type with a well-formed response and records
+    the start/end time and token counts of every call.
+    '''
+    def __init__(self, latency=0.05, jitter=0.0, speak_probability=0.5,
+                 output_words=60, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.speak_probability = speak_probability
+        self.output_words = output_words
+        self.random = random.Random(seed)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, provider, model, messages, temperature, max_tokens):
+        start = time.perf_counter()
+        with self._lock:
+            content = self._respond(messages[-1]["content"])
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        time.sleep(delay)
+        input_tokens = sum(len(m["content"]) for m in messages) // 4
+        output_tokens = len(content) // 4
+        with self._lock:
+            self.calls.append({"start": start, "end": time.perf_counter(),
+                               "input_tokens": input_tokens,
+                               "output_tokens": output_tokens})
+        return content, input_tokens, output_tokens
+
+    def _filler(self):
+        return " ".join(["deliberation"] * self.output_words)
+
+    def _respond(self, prompt):
+        if "straw poll" in prompt:
+            return self.random.choice(["Yes", "No", "Abstain"])
+        if "Respond with ONLY 'Yes' if you wish to speak" in prompt:
+            return "Yes" if self.random.random() < self.speak_probability else "No"
+        if "speakers_order" in prompt:
+            match = re.search(r"\[.*?\]", prompt)
+            return json.dumps({"speakers_order": ast.literal_eval(match.group()) if match else []})
+        if "'announcement'" in prompt:
+            return json.dumps({"announcement": self._filler()})
+        keys = re.findall(r'"(\w+)": "<your response>"', prompt)
+        if keys:
+            response = {}
+            for key in keys:
+                if key == "vote":
+                    response[key] = self.random.choice(["Yes", "No", "Abstain"])
+                else:
+                    response[key] = self._filler()
+            return json.dumps(response)
+        return self._filler()
+
+    def window(self, start, end):
+        # Calls are attributed to the round they started in, including
+        # background calls that finish after the round has returned
+        with self._lock:
+            return [c for c in self.calls if start <= c["start"] < end]
+
+
+def sequential_depth(calls):
+    '''
+    Length of the longest chain of calls where each starts after the previous
+    one ended, i.e. the number of call latencies on the critical path.
+    '''
+    ends = []
+    best = []
+    depth = 0
+    for call in sorted(calls, key=lambda c: c["start"]):
+        # Longest chain among calls that finished before this one started
+        i = bisect.bisect_right(ends, call["start"])
+        chain = (best[i - 1] if i else 0) + 1
+        depth = max(depth, chain)
+        j = bisect.bisect_right(ends, call["end"])
+        ends.insert(j, call["end"])
+        best.insert(j, max(chain, best[j - 1] if j else 0))
+        for k in range(j + 1, len(best)):
+            best[k] = max(best[k], best[k - 1])
+    return depth
+
+
+def council(size):
+    with open("security_votes.csv", encoding="utf-8") as f:
+        header = f.readline().strip().split(",")
+    names = [c for c in header if c not in ["date", "descr", "number"]]
+    names += [f"Country {i}" for i in range(len(names) + 1, size + 1)]
+    return names[:size]
+
+
+def run_game(backend, size, total_rounds, policy, **game_options):
+    agents = [{"name": name} for name in council(size)]
+    game = sim.init_game(agents, policy, conditioning="none", **game_options)
+    rounds = []
+    game_start = time.perf_counter()
+    current_round = 1
+    vote_round = total_rounds
+    while True:
+        start = time.perf_counter()
+        round_data, outcome, vote_list = game.run_round(current_round, vote_round)
+        end = time.perf_counter()
+        calls = backend.window(start, end)
+        rounds.append({
+            "round": current_round,
+            "wall_clock": end - start,
+            "llm_calls": len(calls),
+            "sequential_depth": sequential_depth(calls),
+            "input_tokens": sum(c["input_tokens"] for c in calls),
+            "output_tokens": sum(c["output_tokens"] for c in calls),
+        })
+        if outcome:
+            vote_results = {'Yes': sum(1 for vote in vote_list if vote[1] == 'Yes'),
+                            'No': sum(1 for vote in vote_list if vote[1] == 'No'),
+                            'Abstain': sum(1 for vote in vote_list if vote[1] == 'Abstain'),
+                            }
+            game.log_voting_round(round_data, vote_results, outcome)
+            break
+        if game.should_end_discussion(current_round, vote_round):
+            vote_round = current_round + 1
+        current_round += 1
+    return {
+        "council_size": size,
+        "total_rounds": total_rounds, #as configured
+        "vote_round": vote_round, #earlier than total_rounds if the discussion ended early
+        "rounds_played": len(rounds),
+        "wall_clock": time.perf_counter() - game_start,
+        "llm_calls": sum(r["llm_calls"] for r in rounds),
+        "input_tokens": sum(r["input_tokens"] for r in rounds),
+        "output_tokens": sum(r["output_tokens"] for r in rounds),
+        "rounds": rounds,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 15, 50, 193])
+    parser.add_argument("--rounds", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per simulated call")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--speak-probability", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--discussion-mode", choices=["sequential", "simultaneous"], default=sim.DISCUSSION_MODE)
+    parser.add_argument("--chair-scheduler", choices=["llm", "rules"], default=sim.CHAIR_SCHEDULER)
+    parser.add_argument("--no-early-stop", dest="early_stop", action="store_false", default=sim.EARLY_STOP)
+    parser.add_argument("--negotiations", action="store_true", default=sim.NEGOTIATIONS)
+    parser.add_argument("--output", default=None, help="JSON results file")
+    parser.add_argument("--verbose", action="store_true", help="show the simulation's own output")
+    args = parser.parse_args()
+
+    # Rate limits are not what is being measured here
+    configure_scheduler(requests_per_minute=10**9, tokens_per_minute=10**12)
+    policy = "A resolution calling for an immediate ceasefire and humanitarian access."
+    results = []
+    for size in args.sizes:
+        for total_rounds in args.rounds:
+            backend = SimulatedBackend(latency=args.latency, jitter=args.jitter,
+                                       speak_probability=args.speak_probability,
+                                       seed=args.seed)
+            set_llm_backend(backend)
+            output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                result = run_game(backend, size, total_rounds, policy,
+                                  discussion_mode=args.discussion_mode,
+                                  chair_scheduler=args.chair_scheduler,
+                                  early_stop=args.early_stop,
+                                  negotiations=args.negotiations)
+            results.append(result)
+            print(f"size={size:4d} rounds={total_rounds}: {result['wall_clock']:8.2f}s "
+                  f"{result['llm_calls']:6d} calls, depth/round "
+                  f"{[r['sequential_depth'] for r in result['rounds']]}")
+    set_llm_backend(None)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "config": vars(args),
+        "results": results,
+    }
+    output_file = args.output or os.path.join(
+        "benchmarks", "results", f"simulation_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
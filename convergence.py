@@ -0,0 +1,51 @@
+from settings import *
+
+
+class ConvergenceController:
+    '''
+    Decides when a discussion has run its course so the game can skip
+    straight to the vote. Two signals, either of which ends the discussion:
+    - nobody requested to speak for quiet_rounds consecutive rounds
+    - a straw poll of intended votes came back unchanged for stable_rounds
+      consecutive rounds (only when straw_poll is enabled, as it costs one
+      cheap call per agent each round)
+    Only rounds 2 to total_rounds - 2 can be observed, so both streaks are
+    capped at that many rounds; otherwise short games, such as the sweep's
+    4-round discussion baseline, could never end early.
+    '''
+    def __init__(self, quiet_rounds=EARLY_STOP_QUIET_ROUNDS, straw_poll=EARLY_STOP_STRAW_POLL,
+                 stable_rounds=EARLY_STOP_STABLE_ROUNDS):
+        self.quiet_rounds = quiet_rounds
+        self.straw_poll = straw_poll
+        self.stable_rounds = stable_rounds
+        self.quiet_streak = 0
+        self.stable_streak = 0
+        self.last_poll = None
+        self.reason = None
+
+    def observe(self, game, total_rounds):
+        '''
+        Called after each discussion round; returns True once the discussion
+        should end.
+        '''
+        observable_rounds = max(1, total_rounds - 3)
+        requests = game.request_history[-1] if game.request_history else None
+        if requests is not None and not requests:
+            self.quiet_streak += 1
+        else:
+            self.quiet_streak = 0
+        if self.quiet_rounds and self.quiet_streak >= min(self.quiet_rounds, observable_rounds):
+            self.reason = f"no delegate requested to speak for {self.quiet_streak} round{'s' if self.quiet_streak != 1 else ''}"
+            return True
+
+        if self.straw_poll:
+            poll = game.straw_poll()
+            if poll == self.last_poll:
+                self.stable_streak += 1
+            else:
+                self.stable_streak = 0
+            self.last_poll = poll
+            if self.stable_streak >= min(self.stable_rounds, observable_rounds):
+                self.reason = f"straw poll unchanged for {self.stable_streak} round{'s' if self.stable_streak != 1 else ''}"
+                return True
+        return False
@@ -0,0 +1,167 @@
+import csv
+import html
+import io
+import json
+import os
+import threading
+import time
+
+
+class EventLog:
+    '''
+    Append-only log of typed game events, written to a JSONL file as they
+    happen. Nothing is kept in memory; markdown, HTML and CSV views are
+    rendered lazily from the file, one chunk at a time.
+
+    Event types:
+    - game_start: agents, policy, discussion_mode, chair_scheduler, negotiations
+    - chair: round, name, fields (a chairperson statement)
+    - agent_output: round, name, fields (an agent's parsed outputs)
+    - vote: round, name, fields (final reflection, vote plan, vote)
+    - early_stop: round, reason (discussion ended before the planned rounds)
+    - negotiation: round, members, fields (private transcript and each member's digest)
+    - negotiation_skipped: round, reason (no side negotiations after that round)
+    - outcome: round, results (vote counts), outcome
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def emit(self, event_type, **fields):
+        event = {"type": event_type, "time": time.time(), **fields}
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        # Reopen per event so every event is on disk even if the process dies
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def events(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def render_markdown(self):
+        current_round = None
+        for event in self.events():
+            kind = event["type"]
+            if kind == "game_start":
+                yield f"# Game Log\n\n**Discussion mode**: {event.get('discussion_mode', 'sequential')}\n\n"
+                yield "## Agents\n\n" + "\n".join(f"- {name}" for name in event["agents"])
+            elif kind in ("chair", "agent_output"):
+                if event["round"] != current_round:
+                    current_round = event["round"]
+                    yield f"\n\n## Round {current_round}\n\n"
+                yield f"### {event['name']}\n\n"
+                for key, value in event["fields"].items():
+                    yield f"**{key.capitalize()}**: {value}\n\n"
+            elif kind == "vote":
+                if current_round != ("vote", event["round"]):
+                    current_round = ("vote", event["round"])
+                    yield f"\n\n## Round {event['round']} (Voting)\n\n"
+                fields = event["fields"]
+                yield f"### {event['name']}\n\n"
+                yield f"**Final Reflection**: {fields.get('final_thoughts', '')}\n\n"
+                yield f"**Vote Plan**: {fields.get('vote_plan', '')}\n\n"
+                yield f"**Vote**: {fields.get('vote', '')}\n\n"
+                if "error" in fields:
+                    yield f"**Error**: {fields['error']}\n\n"
+            elif kind == "early_stop":
+                yield f"\n\n*Discussion ended after round {event['round']}: {event['reason']}.*\n"
+            elif kind == "negotiation":
+                yield f"### Side negotiation after round {event['round']}: {', '.join(event['members'])}\n\n"
+                yield f"{event['fields']['transcript']}\n\n"
+                for name, digest in event["fields"]["digests"].items():
+                    yield f"**Digest ({name})**: {digest}\n\n"
+            elif kind == "negotiation_skipped":
+                yield f"*No side negotiations after round {event['round']}: {event['reason']}.*\n\n"
+            elif kind == "outcome":
+                results = event["results"]
+                yield "\n## Voting Results\n\n"
+                yield f"Yes votes: {results['Yes']}\n"
+                yield f"No votes: {results['No']}\n"
+                yield f"Abstain votes: {results['Abstain']}\n"
+                yield f"\n**Outcome**: {event['outcome']}\n"
+
+    def render_html(self):
+        e = html.escape
+        yield "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Game Log</title></head><body>\n"
+        current_round = None
+        for event in self.events():
+            kind = event["type"]
+            if kind == "game_start":
+                yield "<h1>Game Log</h1>\n"
+                yield f"<p><strong>Discussion mode</strong>: {e(event.get('discussion_mode', 'sequential'))}</p>\n"
+                yield "<h2>Agents</h2>\n<ul>\n"
+                yield "".join(f"<li>{e(name)}</li>\n" for name in event["agents"])
+                yield "</ul>\n"
+            elif kind in ("chair", "agent_output", "vote"):
+                section = (kind == "vote", event["round"])
+                if section != current_round:
+                    current_round = section
+                    suffix = " (Voting)" if kind == "vote" else ""
+                    yield f"<h2>Round {event['round']}{suffix}</h2>\n"
+                yield f"<h3>{e(event['name'])}</h3>\n"
+                for key, value in event["fields"].items():
+                    yield f"<p><strong>{e(key.replace('_', ' ').capitalize())}</strong>: {e(str(value))}</p>\n"
+            elif kind == "early_stop":
+                yield f"<p><em>Discussion ended after round {event['round']}: {e(event['reason'])}.</em></p>\n"
+            elif kind == "negotiation":
+                yield f"<h3>Side negotiation after round {event['round']}: {e(', '.join(event['members']))}</h3>\n"
+                for paragraph in event["fields"]["transcript"].split("\n\n"):
+                    yield f"<p>{e(paragraph)}</p>\n"
+                for name, digest in event["fields"]["digests"].items():
+                    yield f"<p><strong>Digest ({e(name)})</strong>: {e(str(digest))}</p>\n"
+            elif kind == "negotiation_skipped":
+                yield f"<p><em>No side negotiations after round {event['round']}: {e(event['reason'])}.</em></p>\n"
+            elif kind == "outcome":
+                results = event["results"]
+                yield "<h2>Voting Results</h2>\n<ul>\n"
+                for vote in ["Yes", "No", "Abstain"]:
+                    yield f"<li>{vote} votes: {results[vote]}</li>\n"
+                yield f"</ul>\n<p><strong>Outcome</strong>: {e(event['outcome'])}</p>\n"
+        yield "</body></html>\n"
+
+    def render_csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def row(*values):
+            writer.writerow(values)
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        yield row("type", "round", "name", "field", "value")
+        for event in self.events():
+            kind = event["type"]
+            if kind == "game_start":
+                yield row(kind, "", "", "discussion_mode", event.get("discussion_mode", "sequential"))
+                for name in event["agents"]:
+                    yield row(kind, "", name, "", "")
+            elif kind in ("chair", "agent_output", "vote"):
+                for key, value in event["fields"].items():
+                    yield row(kind, event["round"], event["name"], key, value)
+            elif kind == "early_stop":
+                yield row(kind, event["round"], "", "reason", event["reason"])
+            elif kind == "negotiation":
+                members = ", ".join(event["members"])
+                yield row(kind, event["round"], members, "transcript", event["fields"]["transcript"])
+                for name, digest in event["fields"]["digests"].items():
+                    yield row(kind, event["round"], name, "digest", digest)
+            elif kind == "negotiation_skipped":
+                yield row(kind, event["round"], "", "reason", event["reason"])
+            elif kind == "outcome":
+                for vote, count in event["results"].items():
+                    yield row(kind, event["round"], "", vote, count)
+                yield row(kind, event["round"], "", "outcome", event["outcome"])
+
+    def render(self, fmt="md"):
+        renderers = {"md": self.render_markdown, "html": self.render_html, "csv": self.render_csv}
+        return renderers[fmt]()
@@ -1,74 +1,89 @@
 
 
 import os
-from dotenv import load_dotenv
-import numpy as np
-import pickle
-import pandas as pd
 import json
 import re
+import threading
 from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
-from openai import OpenAI
-from anthropic import Anthropic 
+from scheduler import *
 
 # load_dotenv()
 # oai = OpenAI(api_key = os.getenv('OPENAI_API_KEY'))
 from settings import *
-oai = OpenAI(api_key = OPENAI_API_KEY)
 
-ant = Anthropic()
-ant.api_key = os.getenv('ANTHROPIC_API_KEY')
+# Provider clients are created on first use and reused, so importing this
+# module does not load SDKs that a process may never call
+_oai = None
+_ant = None
+_client_lock = threading.Lock()
 
-def gen_oai(messages, model='gpt-4o', temperature=1, max_attempts = 3):
+def get_oai():
+    global _oai
+    with _client_lock:
+        if _oai is None:
+            from openai import OpenAI
+            _oai = OpenAI(api_key = OPENAI_API_KEY)
+        return _oai
+
+def get_ant():
+    global _ant
+    with _client_lock:
+        if _ant is None:
+            from anthropic import Anthropic
+            _ant = Anthropic(api_key = os.getenv('ANTHROPIC_API_KEY'))
+        return _ant
+
+# Optional replacement for the provider APIs, e.g. a simulated-latency backend
+# for benchmarking. Called as backend(provider, model, messages, temperature,
+# max_tokens) and must return (content, input_tokens, output_tokens).
+llm_backend = None
+
+def set_llm_backend(backend):
+    global llm_backend
+    llm_backend = backend
+
+def gen_oai(messages, model='gpt-4o', temperature=1, max_attempts = None,
+            priority = PRIORITY_MESSAGE):
     if model is None:
         model = 'gpt-4o'
-    attempts = 0
-    while attempts < max_attempts:
-        try:
-            response = oai.chat.completions.create(
-                model=model,
-                temperature=temperature,
-                messages=messages,
-                max_tokens=2000
-            )
-            content = response.choices[0].message.content
-            token_usage = response.usage
-            input_tokens = token_usage.prompt_tokens
-            output_tokens = token_usage.completion_tokens
-            
-            # Current pricing
-            input_cost_per_1k = 0.005  # Cost per 1k input tokens
-            output_cost_per_1k = 0.015  # Cost per 1k output tokens
-            
-            # Calculate costs
-            input_cost = (input_tokens / 1000) * input_cost_per_1k
-            output_cost = (output_tokens / 1000) * output_cost_per_1k
-            total_cost = input_cost + output_cost
-            
-            # Print detailed cost breakdown
-            print(f"API call cost breakdown:")
-            print(f" - Input tokens: {input_tokens} tokens ($ {input_cost:.4f})")
-            print(f" - Output tokens: {output_tokens} tokens ($ {output_cost:.4f})")
-            print(f" - Total cost: $ {total_cost:.4f}")
-
-            # Check if content is empty or only whitespace
-            if content.strip() == "":
-                attempts += 1
-                print(f"Attempt {attempts}: Received empty or whitespace response. Retrying...")
-                continue
-            
-            return content
-        except Exception as e:
-            print(f"Error generating completion on attempt {attempts + 1}: {e}")
-            attempts += 1
-            if attempts >= max_attempts:
-              continue
-    return ""
+    def call():
+        if llm_backend is not None:
+            return llm_backend("openai", model, messages, temperature, 2000)
+        response = get_oai().chat.completions.create(
+            model=model,
+            temperature=temperature,
+            messages=messages,
+            max_tokens=2000
+        )
+        content = response.choices[0].message.content
+        token_usage = response.usage
+        input_tokens = token_usage.prompt_tokens
+        output_tokens = token_usage.completion_tokens
+
+        # Current pricing
+        input_cost_per_1k = 0.005  # Cost per 1k input tokens
+        output_cost_per_1k = 0.015  # Cost per 1k output tokens
+
+        # Calculate costs
+        input_cost = (input_tokens / 1000) * input_cost_per_1k
+        output_cost = (output_tokens / 1000) * output_cost_per_1k
+        total_cost = input_cost + output_cost
+
+        # Print detailed cost breakdown
+        print(f"API call cost breakdown:")
+        print(f" - Input tokens: {input_tokens} tokens ($ {input_cost:.4f})")
+        print(f" - Output tokens: {output_tokens} tokens ($ {output_cost:.4f})")
+        print(f" - Total cost: $ {total_cost:.4f}")
+        return content, input_tokens, output_tokens
+    # Raises LLMCallError instead of returning an empty message on failure
+    return get_scheduler().run(call, messages, max_tokens=2000, priority=priority,
+                               max_attempts=max_attempts)
 
 def gen_o1(messages, temperature=1):
   try:
-    response = oai.chat.completions.create(
+    response = get_oai().chat.completions.create(
       model="gpt-4-0125-preview",
       temperature=temperature,
       messages=messages,
@@ -99,31 +114,97 @@ def gen_o1(messages, temperature=1):
     print(f"Error generating completion: {e}")
     raise e
 
-def simple_gen_oai(prompt, model='gpt-4o', temperature=1):
+def simple_gen_oai(prompt, model='gpt-4o', temperature=1, priority=PRIORITY_MESSAGE):
   messages = [{"role": "user", "content": prompt}]
-  return gen_oai(messages, model)
+  return gen_oai(messages, model, priority=priority)
 
 def gen_ant(messages, model='claude-3-5-sonnet-20240620', temperature=1, 
-            max_tokens=1000):
+            max_tokens=1000, system=None, priority=PRIORITY_MESSAGE):
   if model == None:
     model = 'claude-3-5-sonnet-20240620'
-  try:
-    response = ant.messages.create(
+  kwargs = {"system": system} if system else {}
+  def call():
+    if llm_backend is not None:
+      return llm_backend("anthropic", model, messages, temperature, max_tokens)
+    response = get_ant().messages.create(
       model=model,
       max_tokens=max_tokens,
       temperature=temperature,
-      messages=messages
+      messages=messages,
+      **kwargs
     )
     content = response.content[0].text
-    return content
-  except Exception as e:
-    print(f"Error generating completion: {e}")
-    raise e
+    return content, response.usage.input_tokens, response.usage.output_tokens
+  return get_scheduler().run(call, messages, max_tokens=max_tokens, priority=priority)
 
 def simple_gen_ant(prompt, model='claude-3-5-sonnet-20240620'):
   messages = [{"role": "user", "content": prompt}]
   return gen_ant(messages, model)
 
+# Call-site routing
+
+CALL_SITE_PRIORITY = {
+  "speak_poll": PRIORITY_SPEAK_POLL,
+  "straw_poll": PRIORITY_SPEAK_POLL,
+  "chair_order": PRIORITY_CHAIR,
+  "chair_announcement": PRIORITY_CHAIR,
+  "briefing": PRIORITY_BACKGROUND,
+  "reflection": PRIORITY_BACKGROUND,
+  "negotiation": PRIORITY_BACKGROUND,
+  "negotiation_digest": PRIORITY_BACKGROUND,
+  "message": PRIORITY_MESSAGE,
+  "vote": PRIORITY_VOTE,
+}
+
+def to_ant_messages(messages):
+  '''
+  Anthropic takes the system prompt separately and expects alternating
+  roles, so pull out system messages and merge consecutive turns.
+  '''
+  system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+  merged = []
+  for m in messages:
+    if m["role"] == "system":
+      continue
+    if merged and merged[-1]["role"] == m["role"]:
+      merged[-1]["content"] += "\n\n" + m["content"]
+    else:
+      merged.append({"role": m["role"], "content": m["content"]})
+  return system, merged
+
+def gen_routed(call_site, messages, temperature=1):
+  '''
+  Generate with the model chain configured for call_site in LLM_ROUTES,
+  falling back to the next (provider, model) when a call fails.
+  '''
+  priority = CALL_SITE_PRIORITY.get(call_site, PRIORITY_MESSAGE)
+  chain = LLM_ROUTES.get(call_site, STRONG_MODELS)
+  last_error = None
+  for provider, model in chain:
+    try:
+      if provider == "anthropic":
+        system, ant_messages = to_ant_messages(messages)
+        return gen_ant(ant_messages, model, temperature=temperature,
+                       system=system, priority=priority)
+      return gen_oai(messages, model, temperature=temperature, priority=priority)
+    except LLMCallError as e:
+      print(f"{call_site}: {provider}/{model} failed, trying next model in chain")
+      last_error = e
+  raise LLMCallError(f"All models failed for {call_site}: {last_error}",
+                     last_error=last_error)
+
+def map_concurrent(fn, items, max_workers=None):
+  '''
+  fn applied to each item on a thread pool, results in input order. The
+  shared scheduler still bounds the actual request rate.
+  '''
+  items = list(items)
+  if len(items) <= 1:
+    return [fn(item) for item in items]
+  workers = min(max_workers or MAX_WORKERS, len(items))
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    return list(executor.map(fn, items))
+
 # Prompt utils
 
 # Prompt inputs
@@ -213,9 +294,10 @@ def mod_gen(modules: List[Dict], placeholders: Dict, target_keys = None) -> Dict
   prompt = modular_instructions(modules)
   filled = fill_prompt(prompt, placeholders)
   # print(filled)
-  response = simple_gen_oai(filled)
-  if len(response) == 0:
-    print("Error: response was empty")
+  try:
+    response = simple_gen_oai(filled)
+  except LLMCallError as e:
+    print(f"Error: {e}")
     return {}
   if target_keys == None:
     target_keys = [module["name"].lower() for module in modules if "name" in module]
@@ -1,16 +1,21 @@
 import os
 import random
-import io
 import json
-from flask import Flask, render_template, jsonify, request, send_file
+import time
+import uuid
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
 from llm_utils import *
-import feedparser
-from tqdm import tqdm
+from event_log import EventLog
+from memory import AgentMemory
+from convergence import ConvergenceController
+from batch import run_vote_only_games
+from negotiation import SideNegotiations
 import re
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 '''
+import feedparser
+from tqdm import tqdm
+
 NEWS_SOURCES = {
     'BBC News': 'http://feeds.bbci.co.uk/news/world/rss.xml',
     'CNN': 'http://rss.cnn.com/rss/edition_world.rss',
@@ -65,6 +70,8 @@ class Agent:
         self.messages = []
         self.cache_file = f'cache_initial_news_{self.name.lower().replace(" ", "_")}.json'
         self.internal_states = [] #memory of past thoughts
+        self.memory = AgentMemory() #condensed running summary of internal_states
+        self.negotiation_notes = [] #digests of private side negotiations
         assert conditioning in ["none", "news", "un_files"]
         if conditioning == "none":
             self.country_state = None
@@ -97,7 +104,11 @@ STYLE: Write in the style of a diplomatic communication, with concise and clear
             for headline in headlines:
                 prompt += f"- {headline}\n"
             prompts = [{"role": "system", "content": self._create_system_prompt()}, {"role": "user", "content": prompt}]
-            country_state = gen_oai(prompts)
+            try:
+                country_state = gen_routed("briefing", prompts)
+            except LLMCallError as e:
+                print(f"Could not summarize news for {self.name}: {e}")
+                return f"No specific news found for {self.name}"
             return country_state
         country_state = f"No specific news found for {self.name}"
         return country_state
@@ -110,14 +121,46 @@ STYLE: Write in the style of a diplomatic communication, with concise and clear
             {"role": "user", "content": gamestate},
             {"role": "user", "content": instruction},
         ]
-        response = gen_oai(messages)
+        try:
+            response = gen_routed("speak_poll", messages)
+        except LLMCallError as e:
+            print(f"{self.name} could not be polled, treating as not speaking: {e}")
+            return False
         return response.strip().lower() == 'yes'
 
+# Permanent members of the Security Council, under the names used in the vote data and the UI
+P5_MEMBERS = {
+    "USA", "United States", "United States of America",
+    "Russia", "Russian Federation",
+    "UK", "United Kingdom",
+    "France",
+    "China",
+}
+
 class Chairperson:
-    def __init__(self, agents, policy):
+    def __init__(self, agents, policy, scheduler = CHAIR_SCHEDULER, max_per_round = 5):
         self.speakers_list = []
         self.agents = agents  # list of Agent objects
         self.policy = policy
+        assert scheduler in ["llm", "rules"]
+        self.scheduler = scheduler
+        self.max_per_round = max_per_round
+        self.speak_counts = {a.name: 0 for a in agents}
+
+    def record_speaker(self, name):
+        self.speak_counts[name] = self.speak_counts.get(name, 0) + 1
+
+    def schedule_speakers(self, requests):
+        '''
+        Rule-based ordering: delegates who have spoken least go first so the
+        floor rotates fairly, P5 members break ties, then request order.
+        The list is capped at max_per_round.
+        '''
+        order = sorted(
+            range(len(requests)),
+            key=lambda i: (self.speak_counts.get(requests[i], 0), requests[i] not in P5_MEMBERS, i),
+        )
+        return [requests[i] for i in order][:self.max_per_round]
 
     def _create_system_prompt(self):
         return f"""You are the Chairperson of the UN Security Council. The countries in attendance are {', '.join(a.name for a in self.agents)}. Your role is to manage the flow of the meeting fairly and objectively, according to UN procedures. \n \n **PROPOSED RESOLUTION**: \n {self.policy}"""
@@ -131,16 +174,19 @@ class Chairperson:
                 {"role": "user", "content": gamestate},
                 {"role": "user", "content": no_requests_prompt},
             ]
-            response = gen_oai(messages)
             try:
+                response = gen_routed("chair_announcement", messages)
                 data = json.loads(response)
                 announcement = data.get('announcement', 'Chairperson: I encourage delegates to share their views on the matter at hand.')
                 return [], announcement
-            except json.JSONDecodeError:
-                # If parsing fails, return a default announcement
+            except (json.JSONDecodeError, LLMCallError):
+                # If parsing or the call fails, return a default announcement
                 announcement = 'Chairperson: I encourage delegates to share their views on the matter at hand.'
                 return [], announcement
 
+        if self.scheduler == "rules":
+            return self.schedule_speakers(requests), None
+
         # Prompt to generate the speakers list
         prompt = f"""Reorder the countries that have requested to speak in order of priority based on UN procedures. The following countries have requested to speak: {requests}. Return ONLY an ordered list of countries in a JSON object with key 'speakers_order'."""
         messages = [
@@ -148,9 +194,9 @@ class Chairperson:
             {"role": "user", "content": gamestate},
             {"role": "user", "content": prompt},
         ]
-        response = gen_oai(messages)
-        match = re.search(r'\[.*?\]', response)
         try:
+            response = gen_routed("chair_order", messages)
+            match = re.search(r'\[.*?\]', response)
             speakers_order = json.loads(match.group())
             if not isinstance(speakers_order, list):
                 # If speakers_order is not a list, fallback to the requests list
@@ -168,49 +214,63 @@ class Chairperson:
             # If parsing fails, fall back to the requests list as is, and no announcements
             return requests.copy(), None
 
-    def open_discussion(self):
+    default_opening = "Chairperson: I declare this meeting of the Security Council open. The floor is open for statements on the proposed resolution."
+
+    def opening_messages(self):
         prompt = f"The discussion has just begun. The countries in attendance of the meeting are {', '.join(a.name for a in self.agents)}. Create an opening statement to begin the meeting."
-        messages = [
+        return [
             {"role": "system", "content": self._create_system_prompt()},
             {"role": "user", "content": prompt},
         ]
-        response = gen_oai(messages)
+
+    def open_discussion(self):
+        try:
+            response = gen_routed("chair_announcement", self.opening_messages())
+        except LLMCallError as e:
+            print(f"Chairperson could not open the discussion: {e}")
+            response = self.default_opening
         return response
 
 class Game:
-    def __init__(self, agents, policy, max_per_round = 5):
+    def __init__(self, agents, policy, max_per_round = 5, chair_scheduler = CHAIR_SCHEDULER, log_path = None,
+                 discussion_mode = DISCUSSION_MODE, early_stop = EARLY_STOP, negotiations = NEGOTIATIONS):
         self.agents = agents
         self.policy = policy
         self.public_messages = []
         self.round_number = 0
         self.outcome = ""
         self.gamestate = "Nothing has been said yet. Start the conversation. You don't know anything about the other countries yet, and vice versa.\n"
-        self.log = ""
-        self.chairperson = Chairperson(self.agents, self.policy)
+        if log_path is None:
+            log_path = os.path.join(LOG_DIR, f"game_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.jsonl")
+        self.event_log = EventLog(log_path)
+        assert discussion_mode in ["sequential", "simultaneous"]
+        self.discussion_mode = discussion_mode
+        self.side_negotiations = SideNegotiations(self) if negotiations else None
+        self.event_log.emit("game_start", agents=[a.name for a in agents], policy=policy,
+                            discussion_mode=discussion_mode, chair_scheduler=chair_scheduler,
+                            negotiations=negotiations)
+        self.request_history = [] #speak requests of each discussion round
+        self.convergence = ConvergenceController() if early_stop else None
+        self.ended_early_after = None #last discussion round if the discussion ended early
         self.max_per_round = max_per_round
+        self.chairperson = Chairperson(self.agents, self.policy, scheduler = chair_scheduler, max_per_round = max_per_round)
 
     def update_gamestate(self, agent_name, message):
         self.public_messages.append(f"{agent_name}: {message}")
         self.gamestate = "START OF CONVERSATION SO FAR.\n" + "\n".join(self.public_messages) + "\nEND OF CONVERSATION SO FAR."
 
     def summarize_thoughts(self, agent):
-        if not agent.internal_states:
+        # The memory is condensed in the background as reflections come in
+        memory = agent.memory.wait()
+        if not memory:
             return ""
-        text = "Your previous reflections:\n"
-        for i, state in enumerate(agent.internal_states, 1):
-            text += f"\nRound {i}:\n"
-            for key, value in state.items():
-                text += f"- {key.capitalize()}: {value}\n"
-        system_prompt = self._create_system_prompt(agent)
-        prompt = f'''These are your reflections after each round. Based on these reflections, summarize the key points and highlight the most important insights gained over all rounds.\n{text}'''
-        prompts = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-        output = gen_oai(prompts)
-        return f"REFLECTION ON WHOLE CONVERSATION:\n{output}"
+        return f"REFLECTION ON WHOLE CONVERSATION:\n{memory}"
+
+    def instruct_agent(self, agent, instruction, final_thoughts= None, call_site="message"):
+        messages = self.agent_messages(agent, instruction, final_thoughts = final_thoughts)
+        return gen_routed(call_site, messages)
 
-    def instruct_agent(self, agent, instruction, final_thoughts= None):
+    def agent_messages(self, agent, instruction, final_thoughts= None):
         system_prompt = self._create_system_prompt(agent)
         messages = [
             {"role": "system", "content": system_prompt},
@@ -221,9 +281,12 @@ class Game:
             if agent.country_state is not None:
                 country_state = f"CURRENT STATE OF THE COUNTRY:\n{agent.country_state}"
                 messages.append({"role": "user", "content": country_state})
+            if agent.negotiation_notes:
+                notes = "\n".join(f"- {note}" for note in agent.negotiation_notes[-NEGOTIATION_NOTES_IN_PROMPT:])
+                messages.append({"role": "user", "content": f"YOUR NOTES FROM PRIVATE SIDE NEGOTIATIONS:\n{notes}"})
         messages.append({"role": "user", "content": self.gamestate})
         messages.append({"role": "user", "content": instruction})
-        return gen_oai(messages)
+        return messages
 
     def _create_system_prompt(self, agent):
         country_state_string = "Consider the state of your country as given and reference it throughout your discussion." if agent.country_state is not None else ""
@@ -236,6 +299,41 @@ PROPOSED RESOLUTION: {self.policy}
 
 STYLE: Write in the style of a diplomatic communication, with concise and clear messages."""
 
+    def straw_poll(self):
+        '''
+        Cheap non-binding poll of how each agent would vote right now, used to
+        detect when the discussion has stopped changing anyone's mind.
+        '''
+        instruction = "This is a non-binding straw poll. If the vote were held now, how would your country vote? Respond with ONLY 'Yes', 'No' or 'Abstain'."
+        def poll(agent):
+            messages = [{"role": "system", "content": self._create_system_prompt(agent)}]
+            if agent.country_state is not None:
+                messages.append({"role": "user", "content": f"CURRENT STATE OF THE COUNTRY:\n{agent.country_state}"})
+            messages.append({"role": "user", "content": self.gamestate})
+            messages.append({"role": "user", "content": instruction})
+            try:
+                response = gen_routed("straw_poll", messages).strip().strip(".'\"").capitalize()
+            except LLMCallError as e:
+                print(f"Straw poll failed for {agent.name}: {e}")
+                return None
+            return response if response in ['Yes', 'No', 'Abstain'] else None
+        votes = map_concurrent(poll, self.agents)
+        return {agent.name: vote for agent, vote in zip(self.agents, votes)}
+
+    def should_end_discussion(self, current_round, total_rounds):
+        '''
+        Called after a discussion round. True when the convergence controller
+        wants to skip the remaining discussion rounds and vote next.
+        '''
+        if self.convergence is None or current_round + 1 >= total_rounds:
+            return False
+        if not self.convergence.observe(self, total_rounds):
+            return False
+        print(f"Ending discussion after round {current_round}: {self.convergence.reason}")
+        self.event_log.emit("early_stop", round=current_round, reason=self.convergence.reason)
+        self.ended_early_after = current_round
+        return True
+
     def _get_modules_for_round(self, current_round, total_rounds):
         if total_rounds == 1:
             return [self.vote_plan, self.vote]
@@ -246,41 +344,115 @@ STYLE: Write in the style of a diplomatic communication, with concise and clear
         else:
             return [self.reflect, self.plan, self.message]
 
-    def _update_log(self, agent_data, current_round):
-        if current_round != self.round_number:
-            self.round_number = current_round
-            self.log += f"\n\n## Round {current_round}\n\n"
+    def _update_log(self, agent_data, current_round, event_type = "agent_output"):
+        self.round_number = current_round
+        fields = {key: value for key, value in agent_data.items() if key != "name"}
+        self.event_log.emit(event_type, round=current_round, name=agent_data["name"], fields=fields)
 
-        self.log += f"### {agent_data['name']}\n\n"
-        for key, value in agent_data.items():
-            if key != "name":
-                self.log += f"**{key.capitalize()}**: {value}\n\n"
+    def _agent_turn(self, agent, modules, include_reflection):
+        print("=" * 20)
+        target_keys = [module["name"] for module in modules]
+        instruction = modular_instructions(modules)
+        agent_data = {"name": agent.name}
+        if include_reflection:
+            final_thoughts = self.summarize_thoughts(agent)
+            agent_data["final_thoughts"] = final_thoughts
+        else:
+            final_thoughts = None
+        call_site = "vote" if include_reflection else "message"
+        try:
+            response = self.instruct_agent(agent, instruction, final_thoughts = final_thoughts, call_site=call_site)
+        except LLMCallError as e:
+            # Record the failure explicitly rather than as an empty message
+            print(f"{agent.name} failed to respond: {e}")
+            agent_data["error"] = str(e)
+            return agent_data, None
+        return agent_data, parse_json(response, target_keys=target_keys)
+
+    def _record_turn(self, agent, agent_data, parsed, target_keys, current_round, event_type, round_data):
+        if parsed is not None:
+            for key in target_keys:
+                if key in parsed:
+                    agent_data[key] = parsed[key]
+                    print(f"{agent.name} {key.upper()}: {parsed[key]}")
+                    print()
+            internal_outputs = {key: parsed[key] for key in target_keys if key == 'reflection' and key in parsed}
+            agent.internal_states.append(internal_outputs)
+            agent.memory.add(current_round, internal_outputs, self._create_system_prompt(agent))
+
+            if "message" in parsed:
+                self.update_gamestate(agent.name, parsed["message"])
+                self.chairperson.record_speaker(agent.name)
+
+        self._update_log(agent_data, current_round, event_type = event_type)
+
+        round_data.append(agent_data)
+
+    def record_opening(self, opening_statement):
+        self.update_gamestate("Chairperson", opening_statement)
+        chairperson_data = {"name": "Chairperson", "message": opening_statement}
+        self._update_log(chairperson_data, 1, event_type = "chair")
+        return chairperson_data
+
+    def vote_requests(self, current_round, total_rounds):
+        '''
+        Messages for every agent's vote in the final round, for running the
+        vote outside of run_round (e.g. through the batch API).
+        '''
+        modules = self._get_modules_for_round(current_round, total_rounds)
+        instruction = modular_instructions(modules)
+        return [(agent, self.agent_messages(agent, instruction, final_thoughts = self.summarize_thoughts(agent)))
+                for agent in self.agents]
+
+    def record_votes(self, responses, current_round, total_rounds, round_data = None):
+        '''
+        Counterpart of vote_requests: responses maps agent names to the raw
+        response text, or to an LLMCallError if the request failed.
+        '''
+        round_data = round_data if round_data is not None else []
+        modules = self._get_modules_for_round(current_round, total_rounds)
+        target_keys = [module["name"] for module in modules]
+        for agent in self.agents:
+            agent_data = {"name": agent.name, "final_thoughts": self.summarize_thoughts(agent)}
+            response = responses.get(agent.name)
+            if isinstance(response, LLMCallError) or response is None:
+                agent_data["error"] = str(response) if response is not None else "No response"
+                parsed = None
+            else:
+                parsed = parse_json(response, target_keys=target_keys)
+            self._record_turn(agent, agent_data, parsed, target_keys, current_round, "vote", round_data)
+        return self._process_voting_results(round_data)
 
     def run_round(self, current_round, total_rounds):
         round_data = []
         modules = self._get_modules_for_round(current_round, total_rounds)
         target_keys = [module["name"] for module in modules]
         include_reflection = "vote_plan" in target_keys
+        event_type = "vote" if include_reflection else "agent_output"
+        if self.side_negotiations is not None:
+            if include_reflection:
+                # Votes must see every negotiation digest
+                self.side_negotiations.wait()
+            elif current_round > 1:
+                # Negotiate on the previous round in the background while this
+                # one runs. Started here rather than at the end of the previous
+                # round so that no phase is started when the vote is next,
+                # including after the discussion has ended early.
+                self.side_negotiations.start(current_round - 1)
 
         # First round: All agents make introductions, Last round: All agents vote
         if current_round == 1 or include_reflection:
             requests = [agent.name for agent in self.agents]
             #Chairperson starts conversation
         else:
-            # Agents decide whether to request to speak
-            requests = []
-            for agent in self.agents:
-                wants_to_speak = agent.decide_to_speak(self.gamestate)
-                if wants_to_speak:
-                    requests.append(agent.name)
+            # Agents decide whether to request to speak, all polled at once
+            decisions = map_concurrent(lambda agent: agent.decide_to_speak(self.gamestate), self.agents)
+            requests = [agent.name for agent, wants_to_speak in zip(self.agents, decisions) if wants_to_speak]
+            self.request_history.append(requests)
 
         #Open meeting
         if current_round == 1:
-            opening_statement = self.chairperson.open_discussion()
-            self.update_gamestate("Chairperson", opening_statement)
-            chairperson_data = {"name": "Chairperson", "message": opening_statement}
-            round_data.append(chairperson_data)
-            self._update_log(chairperson_data, current_round)
+            round_data.append(self.record_opening(self.chairperson.open_discussion()))
         # Chairperson manages the speakers list
         if not include_reflection:
             speakers_order, announcement = self.chairperson.manage_speakers_list(self.gamestate, requests, current_round, total_rounds)
@@ -291,38 +463,23 @@ STYLE: Write in the style of a diplomatic communication, with concise and clear
             self.update_gamestate("Chairperson", announcement)
             chairperson_data = {"name": "Chairperson", "message": announcement}
             round_data.append(chairperson_data)
-            self._update_log(chairperson_data, current_round)
+            self._update_log(chairperson_data, current_round, event_type = "chair")
         else:
             # Proceed to have agents speak in order
             if len(speakers_order) > self.max_per_round and not include_reflection: #Cap the number of speakers, only if it isnt voting
                 speakers_order = speakers_order[:self.max_per_round]
-            for agent_name in speakers_order:
-                agent = next(a for a in self.agents if a.name == agent_name)
-                print("=" * 20)
-                instruction = modular_instructions(modules)
-                agent_data = {"name": agent.name}
-                if include_reflection:
-                    final_thoughts = self.summarize_thoughts(agent)
-                    agent_data["final_thoughts"] = final_thoughts
-                else:
-                    final_thoughts = None
-                response = self.instruct_agent(agent, instruction, final_thoughts = final_thoughts)
-                parsed = parse_json(response, target_keys=target_keys)
-
-                for key in target_keys:
-                    if key in parsed:
-                        agent_data[key] = parsed[key]
-                        print(f"{agent.name} {key.upper()}: {parsed[key]}")
-                        print()
-                internal_outputs = {key: parsed[key] for key in target_keys if key == 'reflection' and key in parsed}
-                agent.internal_states.append(internal_outputs)
-
-                if "message" in parsed:
-                    self.update_gamestate(agent.name, parsed["message"])
-
-                self._update_log(agent_data, current_round)
-
-                round_data.append(agent_data)
+            speakers = [next(a for a in self.agents if a.name == agent_name) for agent_name in speakers_order]
+            if include_reflection or self.discussion_mode == "simultaneous":
+                # Everyone responds to the same transcript at once; messages are
+                # appended afterwards in the chairperson's order. Votes never see
+                # each other, so they always run this way.
+                turns = map_concurrent(lambda agent: self._agent_turn(agent, modules, include_reflection), speakers)
+                for agent, (agent_data, parsed) in zip(speakers, turns):
+                    self._record_turn(agent, agent_data, parsed, target_keys, current_round, event_type, round_data)
+            else:
+                for agent in speakers:
+                    agent_data, parsed = self._agent_turn(agent, modules, include_reflection)
+                    self._record_turn(agent, agent_data, parsed, target_keys, current_round, event_type, round_data)
 
         if current_round == total_rounds:
             return self._process_voting_results(round_data)
@@ -361,21 +518,11 @@ STYLE: Write in the style of a diplomatic communication, with concise and clear
         return round_data, outcome, vote_list
 
     def log_voting_round(self, round_data, vote_results, outcome):
-        self.log += f"\n\n## Round {self.round_number} (Voting)\n\n"
-        for agent_data in round_data:
-            self.log += f"### {agent_data['name']}\n\n"
-            self.log += f"**Final Reflection**: {agent_data.get('final_thoughts', '')}\n\n"
-            self.log += f"**Vote Plan**: {agent_data.get('vote_plan', '')}\n\n"
-            self.log += f"**Vote**: {agent_data.get('vote', '')}\n\n"
-
-        self.log += "\n## Voting Results\n\n"
-        self.log += f"Yes votes: {vote_results['Yes']}\n"
-        self.log += f"No votes: {vote_results['No']}\n"
-        self.log += f"Abstain votes: {vote_results['Abstain']}\n"
-        self.log += f"\n**Outcome**: {outcome}\n"
+        # The individual votes were logged as they were cast in run_round
+        self.event_log.emit("outcome", round=self.round_number, results=vote_results, outcome=outcome)
 
     def get_log(self):
-        return self.log
+        return "".join(self.event_log.render_markdown())
 
     intro = {
         "name": "introduction",
@@ -415,16 +562,16 @@ STYLE: Write in the style of a diplomatic communication, with concise and clear
         "description": "your vote",
     }
 
-def init_game(agents, policy, conditioning):
+def init_game(agents, policy, conditioning, chair_scheduler = CHAIR_SCHEDULER, log_path = None,
+              discussion_mode = DISCUSSION_MODE, early_stop = EARLY_STOP, negotiations = NEGOTIATIONS):
     '''
     if conditioning == "news":
         load_cache()
         scrape_all_headlines()
     '''
     initialized_agents = [Agent(agent_data["name"], conditioning = conditioning) for agent_data in agents]
-    game = Game(initialized_agents, policy)
-    # Log the agents
-    game.log = f"# Game Log\n\n## Agents\n\n" + "\n".join([f"- {agent.name}" for agent in initialized_agents])
+    game = Game(initialized_agents, policy, chair_scheduler = chair_scheduler, log_path = log_path,
+                discussion_mode = discussion_mode, early_stop = early_stop, negotiations = negotiations)
     return game
 
 app = Flask(__name__)
@@ -441,8 +588,12 @@ def add_agents():
     country_names = data['country_names']
     policy = data.get('policy', 'the proposed UN policy')
     conditioning = data.get('conditioning', 'none')
+    chair_scheduler = data.get('chair_scheduler', CHAIR_SCHEDULER)
+    discussion_mode = data.get('discussion_mode', DISCUSSION_MODE)
+    negotiations = data.get('negotiations', NEGOTIATIONS)
     agents = [{"name": name} for name in country_names]
-    game = init_game(agents, policy, conditioning)
+    game = init_game(agents, policy, conditioning, chair_scheduler = chair_scheduler, discussion_mode = discussion_mode,
+                     negotiations = negotiations)
     return jsonify({"status": "success"})
 
 @app.route('/next_round', methods=['POST'])
@@ -465,14 +616,21 @@ def next_round():
                 "finished": True,
                 "outcome": outcome,
                 "votes": {agent: vote for agent, vote in vote_list},
-                "round_data": round_data
+                "round_data": round_data,
+                "discussion_mode": game.discussion_mode
             })
         else:
             # Game continues
-            return jsonify({
+            response = {
                 "finished": False,
-                "round_data": round_data
-            })
+                "round_data": round_data,
+                "discussion_mode": game.discussion_mode
+            }
+            if game.should_end_discussion(current_round, total_rounds):
+                # Tell the client to vote in the next round
+                response["total_rounds"] = current_round + 1
+                response["early_stop"] = game.convergence.reason
+            return jsonify(response)
     else:
         return jsonify({"finished": True})
 
@@ -482,18 +640,27 @@ def reset_game():
     game = None
     return jsonify({"status": "reset"})
 
+LOG_FORMATS = {
+    'md': 'text/markdown',
+    'html': 'text/html',
+    'csv': 'text/csv',
+}
+
 @app.route('/download_log', methods=['GET'])
 def download_log():
     if game:
-        log_content = game.get_log()
-        buffer = io.BytesIO()
-        buffer.write(log_content.encode('utf-8'))
-        buffer.seek(0)
-        return send_file(buffer, as_attachment=True, download_name='game_log.md', mimetype='text/markdown')
+        fmt = request.args.get('format', 'md')
+        if fmt not in LOG_FORMATS:
+            return jsonify({"error": f"Unknown log format: {fmt}"}), 400
+        # Rendered lazily from the event file as the response streams
+        return Response(stream_with_context(game.event_log.render(fmt)), mimetype=LOG_FORMATS[fmt],
+                        headers={"Content-Disposition": f"attachment; filename=game_log.{fmt}"})
     else:
         return jsonify({"error": "No game log available"}), 400
 
 def load_data(file_path):
+    # Imported here so the web app does not pay for pandas at startup
+    import pandas as pd
     # Load the CSV file into a DataFrame
     df = pd.read_csv(file_path)
     
@@ -527,189 +694,229 @@ def compute_similarity(gt_vote, sim_vote):
         return 0.5
     else:  # gt_vote != sim_vote and not involving 'Abstain'
         return 0.0
-def main():
-    data = load_data("security_votes.csv")
-    # Define baselines
-    baselines = [
-        {'name': 'No discussion, No conditioning', 'conditioning': 'none', 'total_rounds': 1},
-        {'name': 'Discussion, No conditioning', 'conditioning': 'none', 'total_rounds': 4},
-    ]
+# Baselines of the evaluation sweep, each run NUM_RUNS times per policy
+BASELINES = [
+    {'name': 'No discussion, No conditioning', 'conditioning': 'none', 'total_rounds': 1},
+    {'name': 'Discussion, No conditioning', 'conditioning': 'none', 'total_rounds': 4},
+]
+NUM_RUNS = 3
+
+def run_dir(policy_idx, baseline):
+    baseline_name = baseline['name'].replace(' ', '_').lower()
+    return f'policy_{policy_idx+1}_{baseline_name}'
+
+def new_run_log(policy_idx, baseline, run_idx):
+    policy_dir = run_dir(policy_idx, baseline)
+    os.makedirs(policy_dir, exist_ok=True)
+    log_path = os.path.join(policy_dir, f'run_{run_idx+1}_events.jsonl')
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    return log_path
+
+def get_baseline(name):
+    return next(b for b in BASELINES if b['name'] == name)
+
+def ground_truth(votes_dict):
+    # Map ground truth votes to 'Yes', 'No', 'Abstain'
+    ground_truth_votes = {}
+    for country, vote in votes_dict.items():
+        if vote == 2:
+            ground_truth_votes[country] = 'Yes'
+        elif vote == 1:
+            ground_truth_votes[country] = 'Abstain'
+        elif vote == 0:
+            ground_truth_votes[country] = 'No'
+        else:
+            ground_truth_votes[country] = 'Abstain'  # Default to 'Abstain' for unknown values
+    return ground_truth_votes
+
+def play_game(game, total_rounds):
+    current_round = 1
+    while True:
+        round_data, outcome, vote_list = game.run_round(current_round, total_rounds)
+        if outcome:
+            # Game is finished
+            return round_data, outcome, vote_list
+        if game.should_end_discussion(current_round, total_rounds):
+            total_rounds = current_round + 1 #Vote in the next round
+        current_round += 1
+
+def finish_run(policy_idx, policy_entry, baseline, run_idx, game, round_data, outcome, vote_list):
+    '''
+    Log the vote, score the run against the real votes and save its log and
+    simulated votes. Returns the run's result record.
+    '''
+    label_to_idx = {'Yes': 0, 'No': 1, 'Abstain': 2}
+    vote_results = {'Yes': sum(1 for vote in vote_list if vote[1] == 'Yes'),
+                    'No': sum(1 for vote in vote_list if vote[1] == 'No'),
+                    'Abstain': sum(1 for vote in vote_list if vote[1] == 'Abstain'),
+                    }
+    game.log_voting_round(round_data, vote_results, outcome)
+    # Get the simulated votes
+    simulated_votes = {agent: vote for agent, vote in vote_list}
+    country_names = list(policy_entry['votes'].keys())
+    ground_truth_votes = ground_truth(policy_entry['votes'])
+
+    # Initialize confusion matrix for this run
+    confusion_matrix = [[0] * 3 for _ in range(3)]
+    total_similarity = 0
+    total_agents = len(country_names)
+    num_correct = 0
+
+    for agent_name in country_names:
+        simulated_vote = simulated_votes.get(agent_name, 'Abstain')
+        ground_truth_vote = ground_truth_votes.get(agent_name, 'Abstain')
+
+        similarity = compute_similarity(ground_truth_vote, simulated_vote)
+        total_similarity += similarity
+
+        if simulated_vote == ground_truth_vote:
+            num_correct += 1
+
+        # Update confusion matrix
+        sv_idx = label_to_idx.get(simulated_vote, 2)  # Default to 'Abstain' index
+        gt_idx = label_to_idx.get(ground_truth_vote, 2)
+        confusion_matrix[gt_idx][sv_idx] += 1
+
+    # Save the log
+    policy_dir = run_dir(policy_idx, baseline)
+    log_filename = os.path.join(policy_dir, f'run_{run_idx+1}_log.txt')
+    with open(log_filename, 'w', encoding='utf-8') as f:
+        f.writelines(game.event_log.render_markdown())
+    # Also save the simulated votes
+    votes_filename = os.path.join(policy_dir, f'run_{run_idx+1}_votes.json')
+    with open(votes_filename, 'w', encoding='utf-8') as f:
+        json.dump({'discussion_mode': game.discussion_mode, 'votes': simulated_votes}, f)
+
+    return {
+        'policy_idx': policy_idx,
+        'baseline': baseline['name'],
+        'run_idx': run_idx,
+        'discussion_mode': game.discussion_mode,
+        'total_rounds': baseline['total_rounds'],
+        'vote_round': baseline['total_rounds'] if game.ended_early_after is None else game.ended_early_after + 1,
+        'early_stop': game.convergence.reason if game.ended_early_after is not None else None,
+        'simulated_votes': simulated_votes,
+        'votes': [vote for agent, vote in vote_list],
+        'accuracy': num_correct / total_agents,
+        'adjusted_accuracy': total_similarity / total_agents,
+        'confusion_matrix': confusion_matrix,
+    }
+
+def run_job(policy_idx, policy_entry, baseline, run_idx):
+    # Play and score one (policy, baseline, run) of the sweep
+    print(f"RUNNING POLICY: \n \n {policy_entry['policy']}")
+    print(f"RUNNING BASELINE: \n \n {baseline}")
+    agents = [{"name": name} for name in policy_entry['votes']]
+    log_path = new_run_log(policy_idx, baseline, run_idx)
+    game = init_game(agents, policy_entry['policy'], conditioning=baseline['conditioning'], log_path=log_path)
+    round_data, outcome, vote_list = play_game(game, baseline['total_rounds'])
+    return finish_run(policy_idx, policy_entry, baseline, run_idx, game, round_data, outcome, vote_list)
+
+def write_sweep_results(overall_data, policy_confusion_matrices, path = SWEEP_RESULTS_FILE):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'labels': ['Yes', 'No', 'Abstain'],
+            'baselines': overall_data,
+            'policy_confusion_matrices': policy_confusion_matrices,
+        }, f, indent=2)
+
+def aggregate_results(results, baselines = BASELINES):
+    '''
+    Combine run results, in any order, into the overall accuracies and
+    confusion matrices per baseline and save them for report.py.
+    '''
+    baseline_order = [b['name'] for b in baselines]
+    results = sorted(results, key=lambda r: (r['policy_idx'], baseline_order.index(r['baseline']), r['run_idx']))
 
     # Initialize overall data structures
     overall_data = {}
-    labels = ['Yes', 'No', 'Abstain']
-    label_to_idx = {'Yes': 0, 'No': 1, 'Abstain': 2}
+    policy_confusion_matrices = []
     for baseline in baselines:
         baseline_name = baseline['name']
         overall_data[baseline_name] = {
-            'confusion_matrix': np.zeros((3, 3), dtype=int),
+            'confusion_matrix': [[0] * 3 for _ in range(3)],
             'accuracies': [],
             'adjusted_accuracies': [],
-            'vote_distributions': []  # This will collect votes across all policies and runs
+            'vote_distributions': [],  # This will collect votes across all policies and runs
+            'discussion_modes': [],
+            'vote_rounds': [],  # Round each run voted in, earlier than total_rounds if it ended early
         }
 
-    # For each policy_entry in data
-    for policy_idx, policy_entry in data.items():
-        policy_text = policy_entry['policy']
-        print(f"RUNNING POLICY: \n \n {policy_text}")
-        votes_dict = policy_entry['votes']
-
-        # Get the list of countries
-        country_names = list(votes_dict.keys())
-
-        # Map ground truth votes to 'Yes', 'No', 'Abstain'
-        ground_truth_votes = {}
-        for country, vote in votes_dict.items():
-            if vote == 2:
-                ground_truth_votes[country] = 'Yes'
-            elif vote == 1:
-                ground_truth_votes[country] = 'Abstain'
-            elif vote == 0:
-                ground_truth_votes[country] = 'No'
-            else:
-                ground_truth_votes[country] = 'Abstain'  # Default to 'Abstain' for unknown values
-
-        for baseline in baselines:
-            print(f"RUNNING BASELINE: \n \n {baseline}")
-            # Define policy_dir outside the run loop
-            baseline_name = baseline['name'].replace(' ', '_').lower()
-            policy_dir = f'policy_{policy_idx+1}_{baseline_name}'
-            if not os.path.exists(policy_dir):
-                os.makedirs(policy_dir)
-
-            for run_idx in range(3):
-                # Initialize the game
-                agents = [{"name": name} for name in country_names]
-                conditioning = baseline['conditioning']
-                game = init_game(agents, policy_text, conditioning=conditioning)
-                total_rounds = baseline['total_rounds']
-                current_round = 1
-                while True:
-                    round_data, outcome, vote_list = game.run_round(current_round, total_rounds)
-                    if outcome:
-                        # Game is finished
-                        vote_results = {'Yes': sum(1 for vote in vote_list if vote[1] == 'Yes'),
-                                        'No': sum(1 for vote in vote_list if vote[1] == 'No'),
-                                        'Abstain': sum(1 for vote in vote_list if vote[1] == 'Abstain'),
-                                        }
-                        game.log_voting_round(round_data, vote_results, outcome)
-                        break
-                    current_round += 1
-                # Get the simulated votes
-                simulated_votes = {agent: vote for agent, vote in vote_list}
-
-                # Initialize confusion matrix for this run
-                confusion_matrix = np.zeros((3, 3), dtype=int)
-                total_similarity = 0
-                total_agents = len(agents)
-                num_correct = 0
-
-                for agent_name in country_names:
-                    simulated_vote = simulated_votes.get(agent_name, 'Abstain')
-                    ground_truth_vote = ground_truth_votes.get(agent_name, 'Abstain')
-
-                    similarity = compute_similarity(ground_truth_vote, simulated_vote)
-                    total_similarity += similarity
-
-                    if simulated_vote == ground_truth_vote:
-                        num_correct += 1
-
-                    # Update confusion matrix
-                    sv_idx = label_to_idx.get(simulated_vote, 2)  # Default to 'Abstain' index
-                    gt_idx = label_to_idx.get(ground_truth_vote, 2)
-                    confusion_matrix[gt_idx, sv_idx] += 1
-
-                adjusted_accuracy = total_similarity / total_agents
-                overall_data[baseline['name']]['adjusted_accuracies'].append(adjusted_accuracy)
-
-                accuracy = num_correct / total_agents
-                overall_data[baseline['name']]['accuracies'].append(accuracy)
-
-                # Collect votes for vote distribution
-                vote_distributions = [vote for agent, vote in vote_list]
-                overall_data[baseline['name']]['vote_distributions'].extend(vote_distributions)
-
-                # Accumulate confusion matrix into overall data
-                overall_data[baseline['name']]['confusion_matrix'] += confusion_matrix
-
-                # Save the log
-                log_filename = os.path.join(policy_dir, f'run_{run_idx+1}_log.txt')
-                log_content = game.get_log()
-                with open(log_filename, 'w', encoding='utf-8') as f:
-                    f.write(log_content)
-                # Also save the simulated votes
-                votes_filename = os.path.join(policy_dir, f'run_{run_idx+1}_votes.json')
-                with open(votes_filename, 'w', encoding='utf-8') as f:
-                    json.dump(simulated_votes, f)
-
-            # Write adjusted accuracies to a file
-            with open(os.path.join(policy_dir, 'adjusted_accuracy.txt'), 'w', encoding='utf-8') as f:
-                f.write(f'Adjusted Accuracies over 5 runs for baseline {baseline["name"]}:\n')
-                for i, acc in enumerate(overall_data[baseline['name']]['adjusted_accuracies']):
-                    f.write(f'Run {i+1}: {acc:.5f}\n')
-                avg_adjusted_accuracy = sum(overall_data[baseline['name']]['adjusted_accuracies']) / len(overall_data[baseline['name']]['adjusted_accuracies'])
-                f.write(f'Average adjusted accuracy: {avg_adjusted_accuracy:.5f}\n')
-
-            # Create and save the confusion matrix for this policy and baseline
-            df_cm = pd.DataFrame(confusion_matrix, index=labels, columns=labels)
-            plt.figure(figsize=(8, 6))
-            sns.heatmap(df_cm, annot=True, fmt='d', cmap='Blues')
-            plt.xlabel('Predicted Votes')
-            plt.ylabel('True Votes')
-            plt.title(f'Confusion Matrix for Policy {policy_idx+1}, Baseline: {baseline["name"]}')
-            confusion_matrix_filename = os.path.join(policy_dir, 'confusion_matrix.png')
-            plt.savefig(confusion_matrix_filename)
-            plt.close()
-
-    # After looping over all policies
-    # Now, save overall accuracies and confusion matrices per baseline
-    for baseline in baselines:
-        baseline_name = baseline['name']
-        baseline_data = overall_data[baseline_name]
-
-        # Save overall accuracy
-        overall_accuracy_filename = f'overall_accuracy_{baseline_name.replace(" ", "_").lower()}.txt'
-        with open(overall_accuracy_filename, 'w', encoding='utf-8') as f:
-            f.write(f'Overall Accuracies across all policies for baseline {baseline_name}:\n')
-            for i, acc in enumerate(baseline_data['accuracies']):
-                f.write(f'Accuracy {i+1}: {acc:.5f}\n')
-            avg_accuracy = sum(baseline_data['accuracies']) / len(baseline_data['accuracies'])
-            f.write(f'Average accuracy: {avg_accuracy:.5f}\n')
-
-        # Save overall adjusted accuracy
-        overall_adjusted_accuracy_filename = f'overall_adjusted_accuracy_{baseline_name.replace(" ", "_").lower()}.txt'
-        with open(overall_adjusted_accuracy_filename, 'w', encoding='utf-8') as f:
-            f.write(f'Overall Adjusted Accuracies across all policies for baseline {baseline_name}:\n')
+    for idx, result in enumerate(results):
+        baseline_data = overall_data[result['baseline']]
+        baseline_data['adjusted_accuracies'].append(result['adjusted_accuracy'])
+        baseline_data['accuracies'].append(result['accuracy'])
+        baseline_data['vote_rounds'].append(result.get('vote_round'))
+        # Results queued before the mode was recorded have none
+        discussion_mode = result.get('discussion_mode')
+        if discussion_mode not in baseline_data['discussion_modes']:
+            baseline_data['discussion_modes'].append(discussion_mode)
+        # Collect votes for vote distribution
+        baseline_data['vote_distributions'].extend(result['votes'])
+        # Accumulate confusion matrix into overall data
+        for gt_idx in range(3):
+            for sv_idx in range(3):
+                baseline_data['confusion_matrix'][gt_idx][sv_idx] += result['confusion_matrix'][gt_idx][sv_idx]
+
+        # After the last run of a policy and baseline
+        next_result = results[idx + 1] if idx + 1 < len(results) else None
+        if next_result and (next_result['policy_idx'], next_result['baseline']) == (result['policy_idx'], result['baseline']):
+            continue
+        policy_dir = run_dir(result['policy_idx'], get_baseline(result['baseline']))
+        os.makedirs(policy_dir, exist_ok=True)
+        # Write adjusted accuracies to a file
+        with open(os.path.join(policy_dir, 'adjusted_accuracy.txt'), 'w', encoding='utf-8') as f:
+            f.write(f'Adjusted Accuracies over 5 runs for baseline {result["baseline"]}:\n')
             for i, acc in enumerate(baseline_data['adjusted_accuracies']):
-                f.write(f'Adjusted Accuracy {i+1}: {acc:.5f}\n')
+                f.write(f'Run {i+1}: {acc:.5f}\n')
             avg_adjusted_accuracy = sum(baseline_data['adjusted_accuracies']) / len(baseline_data['adjusted_accuracies'])
             f.write(f'Average adjusted accuracy: {avg_adjusted_accuracy:.5f}\n')
 
-        # Save overall confusion matrix
-        df_cm = pd.DataFrame(baseline_data['confusion_matrix'], index=labels, columns=labels)
-        plt.figure(figsize=(8, 6))
-        sns.heatmap(df_cm, annot=True, fmt='d', cmap='Blues')
-        plt.xlabel('Predicted Votes')
-        plt.ylabel('True Votes')
-        plt.title(f'Overall Confusion Matrix for Baseline: {baseline_name}')
-        confusion_matrix_filename = f'overall_confusion_matrix_{baseline_name.replace(" ", "_").lower()}.png'
-        plt.savefig(confusion_matrix_filename)
-        plt.close()
-
-        # Graph the vote distributions across all policies and examples
-        vote_counts = {'Yes': 0, 'No': 0, 'Abstain': 0}
-        for vote in baseline_data['vote_distributions']:
-            vote_counts[vote] += 1
-
-        # Create a bar plot for the vote distribution
-        plt.figure(figsize=(6, 4))
-        plt.bar(vote_counts.keys(), vote_counts.values(), color=['green', 'red', 'gray'])
-        plt.xlabel('Vote')
-        plt.ylabel('Count')
-        plt.title(f'Vote Distribution across all policies for Baseline: {baseline_name}')
-        vote_distribution_filename = f'vote_distribution_{baseline_name.replace(" ", "_").lower()}.png'
-        plt.savefig(vote_distribution_filename)
-        plt.close()
+        # Keep the confusion matrix for this policy and baseline for the report
+        policy_confusion_matrices.append({
+            'policy_idx': result['policy_idx'],
+            'baseline': result['baseline'],
+            'discussion_mode': result.get('discussion_mode'),
+            'dir': policy_dir,
+            'confusion_matrix': result['confusion_matrix'],
+        })
+
+    # Plots and overall accuracy files are generated from these by report.py
+    write_sweep_results(overall_data, policy_confusion_matrices)
+    print(f"Results saved to {SWEEP_RESULTS_FILE}. Run `python report.py` to generate the report.")
+
+def main():
+    data = load_data("security_votes.csv")
+    results = []
+
+    # Games without discussion are independent of each other, so in batch
+    # mode all of them are played up front, one batch per phase
+    batch_games = {}
+    if BATCH_MODE:
+        for policy_idx, policy_entry in data.items():
+            for baseline in BASELINES:
+                if baseline['total_rounds'] != 1:
+                    continue
+                for run_idx in range(NUM_RUNS):
+                    agents = [{"name": name} for name in policy_entry['votes']]
+                    log_path = new_run_log(policy_idx, baseline, run_idx)
+                    batch_games[(policy_idx, baseline['name'], run_idx)] = init_game(
+                        agents, policy_entry['policy'], conditioning=baseline['conditioning'], log_path=log_path)
+    batched = run_vote_only_games(batch_games, mode=BATCH_MODE) if batch_games else {}
+    for (policy_idx, baseline_name, run_idx), (round_data, outcome, vote_list) in batched.items():
+        results.append(finish_run(policy_idx, data[policy_idx], get_baseline(baseline_name), run_idx,
+                                  batch_games[(policy_idx, baseline_name, run_idx)], round_data, outcome, vote_list))
+
+    # For each policy_entry in data
+    for policy_idx, policy_entry in data.items():
+        for baseline in BASELINES:
+            for run_idx in range(NUM_RUNS):
+                if (policy_idx, baseline['name'], run_idx) in batched:
+                    continue
+                results.append(run_job(policy_idx, policy_entry, baseline, run_idx))
+
+    aggregate_results(results)
 
 if __name__ == "__main__":
     #app.run(debug=True)
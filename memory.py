@@ -0,0 +1,89 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_utils import *
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MEMORY_WORKERS, thread_name_prefix="memory")
+        return _executor
+
+
+def format_reflections(states):
+    text = ""
+    for round_number, state in states:
+        text += f"\nRound {round_number}:\n"
+        for key, value in state.items():
+            text += f"- {key.capitalize()}: {value}\n"
+    return text
+
+
+class AgentMemory:
+    '''
+    Running, condensed memory of an agent's reflections. Each new reflection
+    is folded into the summary by a background LLM call as soon as it is
+    added, so the memory is ready (and bounded) by the time the vote starts.
+    Reflections that arrive while an update is in flight are folded in
+    together by the next call.
+    '''
+    def __init__(self):
+        self.summary = ""
+        self._pending = []
+        self._running = False
+        self._cond = threading.Condition()
+
+    def add(self, round_number, state, system_prompt):
+        if not state:
+            return
+        with self._cond:
+            self._pending.append((round_number, state))
+            if not self._running:
+                self._running = True
+                _get_executor().submit(self._drain, system_prompt)
+
+    def _drain(self, system_prompt):
+        while True:
+            with self._cond:
+                batch = self._pending
+                self._pending = []
+                if not batch:
+                    self._running = False
+                    self._cond.notify_all()
+                    return
+                summary = self.summary
+            try:
+                updated = self._condense(summary, batch, system_prompt)
+            except Exception:
+                # Never leave wait() blocked on a worker that died
+                with self._cond:
+                    self._running = False
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                self.summary = updated
+
+    def _condense(self, summary, batch, system_prompt):
+        new_reflections = format_reflections(batch)
+        previous = summary if summary else "Nothing yet."
+        prompt = f'''This is your memory of the discussion so far:\n{previous}\n\nThese are your new reflections:\n{new_reflections}\nUpdate your memory with the new reflections. Summarize the key points and highlight the most important insights gained over all rounds so far, in one concise paragraph.'''
+        prompts = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+        try:
+            return gen_routed("reflection", prompts)
+        except LLMCallError as e:
+            # Keep the raw reflections rather than dropping them
+            print(f"Could not update memory: {e}")
+            return (summary + "\n" + new_reflections).strip()
+
+    def wait(self, timeout=None):
+        # Block until every added reflection has been folded into the summary
+        with self._cond:
+            self._cond.wait_for(lambda: not self._running, timeout=timeout)
+            return self.summary
@@ -0,0 +1,110 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_utils import *
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="negotiation")
+        return _executor
+
+
+def form_groups(agents, group_size):
+    agents = list(agents)
+    random.shuffle(agents)
+    groups = [agents[i:i + group_size] for i in range(0, len(agents), group_size)]
+    # Nobody negotiates alone
+    if len(groups) > 1 and len(groups[-1]) == 1:
+        groups[-2].extend(groups.pop())
+    return [group for group in groups if len(group) > 1]
+
+
+class SideNegotiations:
+    '''
+    Private exchanges between small groups of agents, held between public
+    rounds. All groups negotiate concurrently in the background while the
+    next discussion round goes on, each with a small context of its own: the
+    agents' system prompts and their private exchange, not the public
+    transcript. Afterwards each agent keeps only a short digest, which goes
+    into its internal_states and memory and into its own prompt for later
+    rounds. A phase is skipped if the previous one is still running, so
+    negotiations never queue up behind each other and the vote waits on at
+    most one phase.
+    '''
+    def __init__(self, game, group_size=NEGOTIATION_GROUP_SIZE, turns=NEGOTIATION_TURNS):
+        self.game = game
+        self.group_size = group_size
+        self.turns = turns
+        self._future = None
+
+    def start(self, current_round):
+        if self._future is not None and not self._future.done():
+            reason = "the previous side negotiations are still running"
+            print(f"Skipping side negotiations after round {current_round}: {reason}")
+            self.game.event_log.emit("negotiation_skipped", round=current_round, reason=reason)
+            return
+        self._future = _get_executor().submit(self._run, current_round)
+
+    def wait(self):
+        # Called before the vote so that every digest is in the agents' memory
+        if self._future is not None:
+            try:
+                self._future.result()
+            except Exception as e:
+                print(f"Side negotiations failed: {e}")
+
+    def _run(self, current_round):
+        groups = form_groups(self.game.agents, self.group_size)
+        map_concurrent(lambda group: self._negotiate(group, current_round), groups)
+
+    def _messages(self, agent, group, exchange, instruction):
+        others = ", ".join(a.name for a in group if a is not agent)
+        context = f"PRIVATE SIDE NEGOTIATION with {others}. This exchange is not part of the public record of the meeting. Use it to probe positions, look for common ground or coordinate on the proposed resolution.\n"
+        if exchange:
+            context += "\nEXCHANGE SO FAR:\n" + "\n".join(f"{name}: {text}" for name, text in exchange)
+        else:
+            context += "\nThe exchange has not started yet."
+        messages = [{"role": "system", "content": self.game._create_system_prompt(agent)}]
+        if agent.country_state is not None:
+            messages.append({"role": "user", "content": f"CURRENT STATE OF THE COUNTRY:\n{agent.country_state}"})
+        messages.append({"role": "user", "content": context})
+        messages.append({"role": "user", "content": instruction})
+        return messages
+
+    def _negotiate(self, group, current_round):
+        exchange = []
+        instruction = "Write your next message in this private exchange, in at most three sentences."
+        try:
+            for _ in range(self.turns):
+                for agent in group:
+                    text = gen_routed("negotiation", self._messages(agent, group, exchange, instruction))
+                    exchange.append((agent.name, text.strip()))
+        except LLMCallError as e:
+            print(f"Side negotiation between {', '.join(a.name for a in group)} ended early: {e}")
+        if not exchange:
+            return
+
+        digest_instruction = "For your own notes, summarize in at most two sentences what you learned about the others' positions and any understanding reached in this private exchange."
+        def digest(agent):
+            try:
+                return gen_routed("negotiation_digest", self._messages(agent, group, exchange, digest_instruction)).strip()
+            except LLMCallError as e:
+                print(f"Could not digest the side negotiation for {agent.name}: {e}")
+                return None
+        digests = dict(zip([a.name for a in group], map_concurrent(digest, group)))
+
+        for agent in group:
+            if digests[agent.name]:
+                state = {"negotiation": digests[agent.name]}
+                agent.negotiation_notes.append(digests[agent.name])
+                agent.internal_states.append(state)
+                agent.memory.add(current_round, state, self.game._create_system_prompt(agent))
+        self.game.event_log.emit("negotiation", round=current_round, members=[a.name for a in group],
+                                 fields={"transcript": "\n\n".join(f"{name}: {text}" for name, text in exchange),
+                                         "digests": digests})
@@ -0,0 +1,87 @@
+'''
+Post-processing stage for a sweep run by main(): reads the sweep results
+file and writes the overall accuracy files, confusion matrix heatmaps and
+vote distribution plots. Kept separate so the simulation and the web app
+never import the plotting stack.
+
+Usage:
+    python report.py [sweep_results.json]
+'''
+import json
+import os
+import sys
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import pandas as pd
+import seaborn as sns
+
+from settings import *
+
+
+def plot_confusion_matrix(confusion_matrix, labels, title, filename):
+    df_cm = pd.DataFrame(confusion_matrix, index=labels, columns=labels)
+    plt.figure(figsize=(8, 6))
+    sns.heatmap(df_cm, annot=True, fmt='d', cmap='Blues')
+    plt.xlabel('Predicted Votes')
+    plt.ylabel('True Votes')
+    plt.title(title)
+    plt.savefig(filename)
+    plt.close()
+
+
+def write_report(results):
+    labels = results['labels']
+
+    # Confusion matrix for each policy and baseline
+    for entry in results['policy_confusion_matrices']:
+        os.makedirs(entry['dir'], exist_ok=True)
+        plot_confusion_matrix(entry['confusion_matrix'], labels,
+                              f'Confusion Matrix for Policy {entry["policy_idx"]+1}, Baseline: {entry["baseline"]}',
+                              os.path.join(entry['dir'], 'confusion_matrix.png'))
+
+    # Overall accuracies and confusion matrices per baseline
+    for baseline_name, baseline_data in results['baselines'].items():
+        file_suffix = baseline_name.replace(" ", "_").lower()
+
+        # Save overall accuracy
+        with open(f'overall_accuracy_{file_suffix}.txt', 'w', encoding='utf-8') as f:
+            f.write(f'Overall Accuracies across all policies for baseline {baseline_name}:\n')
+            for i, acc in enumerate(baseline_data['accuracies']):
+                f.write(f'Accuracy {i+1}: {acc:.5f}\n')
+            avg_accuracy = sum(baseline_data['accuracies']) / len(baseline_data['accuracies'])
+            f.write(f'Average accuracy: {avg_accuracy:.5f}\n')
+
+        # Save overall adjusted accuracy
+        with open(f'overall_adjusted_accuracy_{file_suffix}.txt', 'w', encoding='utf-8') as f:
+            f.write(f'Overall Adjusted Accuracies across all policies for baseline {baseline_name}:\n')
+            for i, acc in enumerate(baseline_data['adjusted_accuracies']):
+                f.write(f'Adjusted Accuracy {i+1}: {acc:.5f}\n')
+            avg_adjusted_accuracy = sum(baseline_data['adjusted_accuracies']) / len(baseline_data['adjusted_accuracies'])
+            f.write(f'Average adjusted accuracy: {avg_adjusted_accuracy:.5f}\n')
+
+        # Save overall confusion matrix
+        plot_confusion_matrix(baseline_data['confusion_matrix'], labels,
+                              f'Overall Confusion Matrix for Baseline: {baseline_name}',
+                              f'overall_confusion_matrix_{file_suffix}.png')
+
+        # Graph the vote distributions across all policies and examples
+        vote_counts = {'Yes': 0, 'No': 0, 'Abstain': 0}
+        for vote in baseline_data['vote_distributions']:
+            vote_counts[vote] += 1
+
+        # Create a bar plot for the vote distribution
+        plt.figure(figsize=(6, 4))
+        plt.bar(vote_counts.keys(), vote_counts.values(), color=['green', 'red', 'gray'])
+        plt.xlabel('Vote')
+        plt.ylabel('Count')
+        plt.title(f'Vote Distribution across all policies for Baseline: {baseline_name}')
+        plt.savefig(f'vote_distribution_{file_suffix}.png')
+        plt.close()
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else SWEEP_RESULTS_FILE
+    with open(path, encoding='utf-8') as f:
+        write_report(json.load(f))
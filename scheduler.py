@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from settings import *
+
+# Priority classes, lower runs first when the rate limits are saturated
+PRIORITY_VOTE = 0
+PRIORITY_MESSAGE = 1
+PRIORITY_CHAIR = 2
+PRIORITY_SPEAK_POLL = 3
+PRIORITY_BACKGROUND = 4
+
+
+class LLMCallError(Exception):
+    """Raised when a call could not be completed after all retries."""
+    def __init__(self, message, attempts=0, last_error=None):
+        super().__init__(message)
+        self.attempts = attempts
+        self.last_error = last_error
+
+
+class TokenBucket:
+    """Per-minute budget that refills continuously."""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        # A single request larger than the whole bucket only waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount, now):
+        self._refill(now)
+        self.tokens -= amount
+
+
+def estimate_tokens(messages, max_tokens=0):
+    # Rough heuristic of ~4 characters per token, plus the completion budget
+    chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return chars // 4 + max_tokens
+
+
+def _retry_after(error):
+    '''
+    Seconds the provider asked us to wait, read from the Retry-After header
+    of the error's response if there is one.
+    '''
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class EmptyResponseError(Exception):
+    pass
+
+
+def _is_retryable(error):
+    # Only errors that can clear up on their own; anything else (missing
+    # credentials, bad requests, bugs) fails on the first attempt
+    if isinstance(error, EmptyResponseError):
+        return True
+    for module_name in ["openai", "anthropic"]:
+        # Imported here to keep the SDKs off the startup path
+        try:
+            module = __import__(module_name)
+        except ImportError:
+            continue
+        if isinstance(error, (module.APIConnectionError, module.APITimeoutError)):
+            return True
+        if isinstance(error, module.APIStatusError):
+            status = error.status_code
+            return status == 408 or status == 409 or status == 429 or status >= 500
+    return False
+
+
+class RequestScheduler:
+    '''
+    Shared gate for all LLM calls. Callers block in acquire() until both the
+    request and token buckets have room; when several callers are waiting the
+    one with the lowest priority class goes first. Transient failures are retried
+    with exponential backoff and full jitter, honoring Retry-After, and a
+    rate-limit response pauses every caller, not just the one that hit it.
+    '''
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+                 max_attempts=LLM_MAX_ATTEMPTS, base_delay=LLM_BACKOFF_BASE,
+                 max_delay=LLM_BACKOFF_MAX):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._counter = itertools.count()
+        self._paused_until = 0.0
+        self.stats = {"calls": 0, "retries": 0, "failures": 0,
+                      "input_tokens": 0, "output_tokens": 0}
+
+    def acquire(self, estimated_tokens, priority=PRIORITY_MESSAGE):
+        with self._cond:
+            entry = (priority, next(self._counter))
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._waiting[0] == entry:
+                        wait = max(self._paused_until - now,
+                                   self.request_bucket.wait_time(1, now),
+                                   self.token_bucket.wait_time(estimated_tokens, now))
+                        if wait <= 0:
+                            self.request_bucket.consume(1, now)
+                            self.token_bucket.consume(estimated_tokens, now)
+                            return
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def settle(self, estimated_tokens, actual_tokens):
+        # Correct the token bucket once the real usage is known
+        with self._cond:
+            self.token_bucket.consume(actual_tokens - estimated_tokens, time.monotonic())
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def backoff_delay(self, attempt, error=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = _retry_after(error) if error is not None else None
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def run(self, call, messages, max_tokens=0, priority=PRIORITY_MESSAGE,
+            max_attempts=None):
+        '''
+        Run call() under the rate limits. call must return a tuple of
+        (content, input_tokens, output_tokens). Returns the content, or raises
+        LLMCallError once all attempts are exhausted.
+        '''
+        if max_attempts is None:
+            max_attempts = self.max_attempts
+        estimated = estimate_tokens(messages, max_tokens)
+        last_error = None
+        for attempt in range(max_attempts):
+            self.acquire(estimated, priority)
+            try:
+                content, input_tokens, output_tokens = call()
+            except Exception as e:
+                self.settle(estimated, 0)
+                last_error = e
+                print(f"Error generating completion on attempt {attempt + 1}: {e}")
+                if not _is_retryable(e) or attempt + 1 >= max_attempts:
+                    break
+                delay = self.backoff_delay(attempt, e)
+                if getattr(e, "status_code", None) == 429:
+                    self.pause(delay)
+                self._count("retries")
+                time.sleep(delay)
+                continue
+            self.settle(estimated, input_tokens + output_tokens)
+            self._count("calls")
+            self._count("input_tokens", input_tokens)
+            self._count("output_tokens", output_tokens)
+            if content is None or content.strip() == "":
+                last_error = EmptyResponseError("Received empty or whitespace response")
+                print(f"Attempt {attempt + 1}: Received empty or whitespace response.")
+                if attempt + 1 >= max_attempts:
+                    break
+                self._count("retries")
+                time.sleep(self.backoff_delay(attempt))
+                continue
+            return content
+        self._count("failures")
+        raise LLMCallError(f"LLM call failed after {attempt + 1} attempts: {last_error}",
+                           attempts=attempt + 1, last_error=last_error)
+
+    def _count(self, key, amount=1):
+        with self._cond:
+            self.stats[key] += amount
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+def configure_scheduler(**kwargs):
+    # Replace the shared scheduler, e.g. with different rate limits
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = RequestScheduler(**kwargs)
+        return _scheduler
@@ -7,4 +7,77 @@ KEY_OWNER = "Name"
 DEBUG = True
 MAX_CHUNK_SIZE = 4
 LLM_VERS = "gpt-4o-mini"
-BASE_DIR = f"{Path(__file__).resolve().parent.parent}"
\ No newline at end of file
+BASE_DIR = f"{Path(__file__).resolve().parent.parent}"
+
+# Shared LLM request scheduler
+LLM_REQUESTS_PER_MINUTE = 500
+LLM_TOKENS_PER_MINUTE = 300000
+LLM_MAX_ATTEMPTS = 5
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 60.0
+
+# Model routing per call site: each entry is a fallback chain of (provider, model),
+# tried in order until one succeeds
+FAST_MODELS = [("openai", LLM_VERS), ("anthropic", "claude-3-haiku-20240307")]
+STRONG_MODELS = [("openai", "gpt-4o"), ("anthropic", "claude-3-5-sonnet-20240620")]
+LLM_ROUTES = {
+    "speak_poll": FAST_MODELS,
+    "straw_poll": FAST_MODELS,
+    "chair_order": FAST_MODELS,
+    "chair_announcement": FAST_MODELS,
+    "briefing": STRONG_MODELS,
+    "reflection": STRONG_MODELS,
+    "message": STRONG_MODELS,
+    "vote": STRONG_MODELS,
+    "negotiation": STRONG_MODELS,
+    "negotiation_digest": FAST_MODELS,
+}
+
+# Speaker ordering: "llm" asks the chairperson model, "rules" uses the local
+# fairness/P5 scheduler and only calls the model for announcements
+CHAIR_SCHEDULER = "llm"
+
+# Directory for the per-game JSONL event logs
+LOG_DIR = "logs"
+
+# Background threads that fold new reflections into each agent's memory
+MEMORY_WORKERS = 8
+
+# "sequential": speakers answer one after another, each seeing the previous
+# statements. "simultaneous": all scheduled speakers answer the round-start
+# transcript concurrently and are appended in the chairperson's order.
+DISCUSSION_MODE = "sequential"
+# Threads used for concurrent LLM calls within a round
+MAX_WORKERS = 16
+
+# Adaptive early termination of the discussion (see convergence.py). Set
+# EARLY_STOP_QUIET_ROUNDS to None to only use the straw poll. Only rounds 2
+# to total_rounds - 2 are observed (round 1 has no speak poll, and after
+# total_rounds - 1 the vote is next anyway), so in shorter games both
+# streaks are capped at that many rounds: with total_rounds = 4, as in the
+# sweep's discussion baseline, one quiet round 2 ends the discussion.
+EARLY_STOP = True
+EARLY_STOP_QUIET_ROUNDS = 2
+EARLY_STOP_STRAW_POLL = False
+EARLY_STOP_STABLE_ROUNDS = 2
+
+# Run the independent calls of vote-only sweep baselines as batches:
+# None (interactive calls), "openai" (Batch API) or "local" (stand-in processor)
+BATCH_MODE = None
+BATCH_DIR = "batches"
+BATCH_POLL_INTERVAL = 60
+
+# Sweep results written by main() and read by report.py
+SWEEP_RESULTS_FILE = "sweep_results.json"
+
+# Distributed sweeps (sweep.py)
+SWEEP_QUEUE_FILE = "sweep_queue.db"
+SWEEP_LEASE_SECONDS = 1800
+SWEEP_POLL_INTERVAL = 30
+SWEEP_MAX_ATTEMPTS = 3
+
+# Optional private side negotiations between public rounds (see negotiation.py)
+NEGOTIATIONS = False
+NEGOTIATION_GROUP_SIZE = 2
+NEGOTIATION_TURNS = 2 #messages per agent in each exchange
+NEGOTIATION_NOTES_IN_PROMPT = 3 #most recent digests shown to an agent
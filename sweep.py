@@ -0,0 +1,112 @@
+'''
+Distributed execution of the evaluation sweep in main() over a shared work
+queue. The sweep is materialized as (policy, baseline, run) jobs in a SQLite
+file; any number of workers, on this machine or on other nodes that share
+the directory, lease jobs, play them and write the results back. Aggregation
+then produces the same sweep results file as main(), for report.py.
+
+Usage:
+    python sweep.py init                 # create the queue
+    python sweep.py worker               # run a worker (start as many as wanted)
+    python sweep.py status
+    python sweep.py aggregate            # write the sweep results
+    python sweep.py run --workers 4      # all of the above with local worker processes
+'''
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from settings import *
+from work_queue import WorkQueue
+
+
+def init_queue(queue):
+    from main import load_data, BASELINES, NUM_RUNS
+    data = load_data("security_votes.csv")
+    queue.add_jobs((policy_idx, baseline['name'], run_idx)
+                   for policy_idx in data
+                   for baseline in BASELINES
+                   for run_idx in range(NUM_RUNS))
+    print(f"Queue {queue.path}: {queue.counts()}")
+
+
+def run_worker(queue, worker_id, lease_seconds=SWEEP_LEASE_SECONDS):
+    import main
+    data = main.load_data("security_votes.csv")
+    while True:
+        job = queue.lease(worker_id, lease_seconds)
+        if job is None:
+            counts = queue.counts()
+            if counts['pending'] == 0 and counts['leased'] == 0:
+                print(f"[{worker_id}] No jobs left, exiting")
+                return
+            # Other workers still hold leases; wait in case they expire
+            time.sleep(SWEEP_POLL_INTERVAL)
+            continue
+
+        print(f"[{worker_id}] Job {job['id']}: policy {job['policy_idx']+1}, {job['baseline']}, run {job['run_idx']+1}")
+        # Keep the lease alive while the game is being played
+        done = threading.Event()
+        def heartbeat():
+            while not done.wait(lease_seconds / 3):
+                if not queue.renew(job['id'], worker_id, lease_seconds):
+                    print(f"[{worker_id}] Lost the lease on job {job['id']}")
+                    return
+        threading.Thread(target=heartbeat, daemon=True).start()
+        try:
+            result = main.run_job(job['policy_idx'], data[job['policy_idx']],
+                                  main.get_baseline(job['baseline']), job['run_idx'])
+        except Exception as e:
+            print(f"[{worker_id}] Job {job['id']} failed: {e}")
+            queue.fail(job['id'], worker_id, e)
+            continue
+        finally:
+            done.set()
+        if not queue.complete(job['id'], worker_id, result):
+            print(f"[{worker_id}] Job {job['id']} was taken over by another worker, result discarded")
+
+
+def aggregate(queue):
+    from main import aggregate_results
+    counts = queue.counts()
+    if counts['pending'] or counts['leased']:
+        print(f"Warning: the sweep is not finished yet ({counts})")
+    for policy_idx, baseline, run_idx, error in queue.failures():
+        print(f"Failed: policy {policy_idx+1}, {baseline}, run {run_idx+1}: {error}")
+    aggregate_results(queue.results())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed evaluation sweep")
+    parser.add_argument("command", choices=["init", "worker", "status", "aggregate", "run"])
+    parser.add_argument("--db", default=SWEEP_QUEUE_FILE, help="path of the shared queue file")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--lease", type=float, default=SWEEP_LEASE_SECONDS, help="lease length in seconds")
+    parser.add_argument("--workers", type=int, default=4, help="local worker processes for 'run'")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.db, max_attempts=SWEEP_MAX_ATTEMPTS)
+    if args.command == "init":
+        init_queue(queue)
+    elif args.command == "worker":
+        run_worker(queue, args.worker_id, args.lease)
+    elif args.command == "status":
+        print(queue.counts())
+    elif args.command == "aggregate":
+        aggregate(queue)
+    elif args.command == "run":
+        init_queue(queue)
+        workers = [subprocess.Popen([sys.executable, __file__, "worker", "--db", args.db,
+                                     "--lease", str(args.lease)])
+                   for _ in range(args.workers)]
+        for worker in workers:
+            worker.wait()
+        aggregate(queue)
+
+
+if __name__ == "__main__":
+    main()
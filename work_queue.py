@@ -0,0 +1,115 @@
+import contextlib
+import json
+import sqlite3
+import time
+
+
+class WorkQueue:
+    '''
+    Durable job queue in a SQLite file that any number of worker processes,
+    on this machine or on others sharing the directory, can pull from. A
+    worker leases a job for lease_seconds and must renew the lease while it
+    works; jobs whose lease expires go back to the queue, and a job that
+    fails max_attempts times is marked failed.
+    '''
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    policy_idx INTEGER NOT NULL,
+                    baseline TEXT NOT NULL,
+                    run_idx INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    result TEXT,
+                    error TEXT,
+                    UNIQUE (policy_idx, baseline, run_idx)
+                )""")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # isolation_level=None so transactions are managed explicitly; closing
+        # the connection rolls back anything left uncommitted
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add_jobs(self, jobs):
+        # jobs is an iterable of (policy_idx, baseline, run_idx); existing jobs are kept
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR IGNORE INTO jobs (policy_idx, baseline, run_idx) VALUES (?, ?, ?)",
+                             list(jobs))
+            conn.execute("COMMIT")
+
+    def lease(self, worker_id, lease_seconds):
+        '''
+        Claim the next pending job, or one whose lease has expired. Returns
+        the job as a dict, or None if nothing is available right now.
+        '''
+        now = time.time()
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            conn.execute("BEGIN IMMEDIATE")
+            # Expired leases that used up their attempts will not be retried
+            conn.execute("""UPDATE jobs SET status = 'failed', error = 'lease expired', lease_owner = NULL
+                            WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                         (now, self.max_attempts))
+            row = conn.execute("""SELECT * FROM jobs
+                                  WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+                                  ORDER BY id LIMIT 1""", (now,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("""UPDATE jobs SET status = 'leased', attempts = attempts + 1,
+                            lease_owner = ?, lease_expires = ? WHERE id = ?""",
+                         (worker_id, now + lease_seconds, row["id"]))
+            leased = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+            return dict(leased)
+
+    def renew(self, job_id, worker_id, lease_seconds):
+        # Returns False if the lease was lost to another worker
+        with self._connect() as conn:
+            cursor = conn.execute("""UPDATE jobs SET lease_expires = ?
+                                     WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+                                  (time.time() + lease_seconds, job_id, worker_id))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result):
+        with self._connect() as conn:
+            cursor = conn.execute("""UPDATE jobs SET status = 'done', result = ?, lease_owner = NULL, error = NULL
+                                     WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+                                  (json.dumps(result), job_id, worker_id))
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, worker_id, error):
+        with self._connect() as conn:
+            conn.execute("""UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                            error = ?, lease_owner = NULL, lease_expires = NULL
+                            WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+                         (self.max_attempts, str(error), job_id, worker_id))
+
+    def counts(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        counts.update(dict(rows))
+        return counts
+
+    def results(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT result FROM jobs WHERE status = 'done' ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def failures(self):
+        with self._connect() as conn:
+            return conn.execute("""SELECT policy_idx, baseline, run_idx, error FROM jobs
+                                   WHERE status = 'failed' ORDER BY id""").fetchall()